@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Headless benchmarks for the hot paths of buffer.py.
+
+Point --eaf-path at an EAF checkout so `core' can be imported, no display
+or GPU is needed:
+
+  QT_QPA_PLATFORM=offscreen python benchmarks/bench_player.py \
+      --eaf-path ~/.emacs.d/site-lisp/emacs-application-framework
+
+Results are written as JSON. Any benchmark whose mean is slower than its
+entry in thresholds.json is reported and makes the script exit with 1.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PLAYER_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Defaults of the defcustoms in eaf-video-player.el, there is no Emacs to ask.
+# nil is False, as `get_emacs_var' returns it.
+EMACS_VARS = {
+    "eaf-video-player-subtitle-lookahead": 3,
+    "eaf-video-player-subtitle-cache-size": 64,
+    "eaf-video-player-subtitle-languages": ["en", "eng"],
+    "eaf-video-player-subtitle-download-languages": ["en"],
+    "eaf-video-player-lookup-prefetch": 0,
+    "eaf-video-player-silence-min-duration": 1000,
+    "eaf-video-player-silence-threshold": -50,
+    "eaf-video-player-silence-rate": False,
+    "eaf-video-player-chapter-min-length": 60,
+    "eaf-video-player-frame-ring-size": 120,
+    "eaf-video-player-frame-ring-memory": 256,
+    "eaf-video-player-max-loaded-hidden-buffers": 3,
+    "eaf-video-player-hidden-buffer-timeout": 600,
+    "eaf-video-player-metrics-file": False,
+    "eaf-video-extension-list": ["avi", "webm", "rmvb", "ogg", "mp4", "mkv", "m4v"],
+}
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while lecture notes describe "
+    "gradient descent convergence and stochastic estimates of large matrices"
+).split()
+
+
+def write_srt(path, count, seed=0):
+    """Write a synthetic SubRip file with COUNT cues of 1.5 s every 2 s."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(count):
+            start = index * 2000
+            words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 14)))
+            f.write(
+                f"{index + 1}\n"
+                f"{srt_time(start)} --> {srt_time(start + 1500)}\n"
+                f"<i>{words}</i>\n\n"
+            )
+
+
+def srt_time(milliseconds):
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
+
+
+def write_video(path, seconds):
+    """Generate a small test video with ffmpeg, return False when ffmpeg is missing."""
+    command = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-nostdin",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=duration={seconds}:size=640x360:rate=25",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=duration={seconds}",
+        "-shortest",
+        "-g",
+        "25",
+        path,
+    ]
+    try:
+        return subprocess.run(command).returncode == 0
+    except OSError:
+        return False
+
+
+def measure(func, repeat):
+    """Call FUNC REPEAT times, return per-call milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p95_ms": round(
+            samples[int(len(samples) * 0.95) - 1 if len(samples) > 1 else 0], 4
+        ),
+        "max_ms": round(samples[-1], 4),
+    }
+
+
+class Bench:
+    def __init__(self, buffer, work_dir, app):
+        self.buffer = buffer
+        self.work_dir = work_dir
+        self.app = app
+        self.results = {}
+
+    def add(self, name, samples):
+        self.results[name] = summarize(samples)
+        print(f"{name:40} {self.results[name]}", file=sys.stderr)
+
+    def new_player(self):
+        player = self.buffer.VideoPlayer("#000000", "#ffffff")
+        player.resize(1280, 720)
+        player.show()
+        self.app.processEvents()
+        return player
+
+    def subtitles(self, sizes):
+        player = self.new_player()
+        subtitles = player.subtitles
+        rng = random.Random(0)
+
+        for size in sizes:
+            video_path = os.path.join(self.work_dir, f"cues{size}.mp4")
+            subtitle_path = os.path.join(self.work_dir, f"cues{size}.srt")
+            open(video_path, "wb").close()
+            write_srt(subtitle_path, size)
+
+            # `Subtitles.open' loads in the background, time the blocking part.
+            def open_cold():
+                self.buffer.loaded_timelines.clear()
+                shutil.rmtree(
+                    os.path.join(self.work_dir, "config", "video-player", "subtitles"),
+                    ignore_errors=True,
+                )
+                self.buffer.discover_subtitles(video_path, subtitles.languages)
+
+            def open_warm():
+                self.buffer.loaded_timelines.clear()
+                self.buffer.discover_subtitles(video_path, subtitles.languages)
+
+            self.add(f"subtitles_open_cold[{size}]", measure(open_cold, 3))
+            self.add(f"subtitles_open_warm[{size}]", measure(open_warm, 5))
+            subtitles.set_timeline(
+                self.buffer.discover_subtitles(video_path, subtitles.languages)[1]
+            )
+
+            # Playback: positions advance by a 50 ms tick, then random seeks.
+            positions = iter(range(0, size * 2000, 50))
+            self.add(
+                f"update_subtitle_play[{size}]",
+                measure(
+                    lambda: subtitles.update_subtitle(next(positions)),
+                    min(size * 40, 20000),
+                ),
+            )
+            self.add(
+                f"update_subtitle_seek[{size}]",
+                measure(
+                    lambda: subtitles.update_subtitle(rng.randrange(size * 2000)),
+                    2000,
+                ),
+            )
+
+        texts = [
+            subtitles.timeline.texts[i]
+            for i in range(min(200, len(subtitles.timeline)))
+        ]
+        self.add(
+            "update_view",
+            measure(lambda: subtitles.update_view(rng.choice(texts)), 500),
+        )
+
+        message_box = player.ensure_message_box()
+        self.add(
+            "message_box_update",
+            measure(
+                lambda: message_box.update(" ".join(rng.sample(WORDS, 10)), 640, 600),
+                500,
+            ),
+        )
+
+    def progress_bar(self):
+        from PyQt6.QtGui import QPixmap
+
+        player = self.new_player()
+        player.build_control_panel()
+        progress_bar = player.progress_bar
+        pixmap = QPixmap(progress_bar.size())
+        positions = iter(range(0, 10**9, 40))
+
+        def paint():
+            progress_bar.update_progress(3600 * 1000, next(positions))
+            progress_bar.render(pixmap)
+
+        self.add("progress_bar_paint", measure(paint, 1000))
+
+    def startup(self):
+        """Time from creating a player to `play' returning, with subtitles next to the video."""
+        video_path = os.path.join(self.work_dir, "startup.mp4")
+        open(video_path, "wb").close()
+        write_srt(os.path.join(self.work_dir, "startup.srt"), 10000)
+
+        def start():
+            self.buffer.loaded_timelines.clear()
+            player = self.buffer.VideoPlayer("#000000", "#ffffff")
+            player.play(video_path)
+            player.media_player.stop()
+
+        self.add("player_startup", measure(start, 10))
+
+    def first_frame(self):
+        from PyQt6.QtCore import QEventLoop, QTimer
+
+        video_path = os.path.join(self.work_dir, "first_frame.mp4")
+        if not write_video(video_path, 5):
+            print(
+                "ffmpeg not available, skipping first frame benchmark", file=sys.stderr
+            )
+            return
+
+        samples = []
+        for _ in range(5):
+            player = self.new_player()
+            loop = QEventLoop()
+            player.video_item.videoSink().videoFrameChanged.connect(
+                lambda frame: loop.quit()
+            )
+            QTimer.singleShot(5000, loop.quit)
+            player.play(video_path)
+            loop.exec()
+            self.app.processEvents()
+            player.media_player.stop()
+            timing = self.buffer.metrics.timings.pop("time_to_first_frame", None)
+            if timing is None:
+                print(
+                    "Media backend unavailable, skipping first frame benchmark",
+                    file=sys.stderr,
+                )
+                return
+            samples.append(timing[1])
+        self.add("time_to_first_frame", samples)
+
+    def seek(self):
+        from PyQt6.QtCore import QEventLoop, QTimer, QUrl
+
+        video_path = os.path.join(self.work_dir, "seek.mp4")
+        if not write_video(video_path, 60):
+            print("ffmpeg not available, skipping seek benchmark", file=sys.stderr)
+            return
+
+        player = self.new_player()
+        media_player = player.media_player
+        loop = QEventLoop()
+        media_player.durationChanged.connect(lambda duration: loop.quit())
+        media_player.setSource(QUrl.fromLocalFile(video_path))
+        media_player.pause()
+        QTimer.singleShot(5000, loop.quit)
+        loop.exec()
+        if media_player.duration() <= 0:
+            print("Media backend unavailable, skipping seek benchmark", file=sys.stderr)
+            return
+
+        rng = random.Random(0)
+
+        def seek():
+            media_player.positionChanged.connect(loop.quit)
+            QTimer.singleShot(1000, loop.quit)
+            player.seek_scheduler.seek(rng.randrange(media_player.duration()))
+            loop.exec()
+            media_player.positionChanged.disconnect(loop.quit)
+
+        self.add("seek", measure(seek, 50))
+
+        # A drag across the bar: every mouse move, then the release.
+        issued = player.seek_scheduler.issued
+
+        def scrub():
+            for step in range(200):
+                player.update_video_progress(step / 200)
+                self.app.processEvents()
+            player.finish_video_progress(0.5)
+
+        self.add("scrub", measure(scrub, 3))
+        self.results["scrub"]["seeks_issued"] = player.seek_scheduler.issued - issued
+
+
+def check_thresholds(results, thresholds):
+    regressions = []
+    for name, limit in thresholds.items():
+        result = results.get(name)
+        if result is not None and result["mean_ms"] > limit:
+            regressions.append(
+                {"name": name, "mean_ms": result["mean_ms"], "limit_ms": limit}
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--eaf-path", default=os.environ.get("EAF_PATH"))
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--output", default="-")
+    parser.add_argument(
+        "--thresholds", default=os.path.join(BENCHMARK_DIR, "thresholds.json")
+    )
+    parser.add_argument("--skip-seek", action="store_true")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if args.eaf_path:
+        sys.path.insert(0, os.path.expanduser(args.eaf_path))
+    sys.path.insert(0, PLAYER_DIR)
+
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+
+    import buffer
+
+    work_dir = tempfile.mkdtemp(prefix="eaf-video-player-bench-")
+    config_dir = os.path.join(work_dir, "config")
+    os.makedirs(config_dir)
+
+    # No Emacs behind the benchmark: answer its variables and drop messages.
+    buffer.get_emacs_var = EMACS_VARS.get
+    buffer.get_emacs_vars = lambda names: [EMACS_VARS.get(name) for name in names]
+    buffer.get_emacs_config_dir = lambda: config_dir
+    buffer.message_to_emacs = lambda *args: None
+    buffer.eval_in_emacs = lambda *args: None
+
+    bench = Bench(buffer, work_dir, app)
+    try:
+        bench.subtitles([int(size) for size in args.sizes.split(",")])
+        bench.progress_bar()
+        bench.startup()
+        if not args.skip_seek:
+            bench.first_frame()
+            bench.seek()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+    report = {
+        "results": bench.results,
+        "regressions": check_thresholds(bench.results, thresholds),
+    }
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for regression in report["regressions"]:
+        print(
+            f"REGRESSION {regression['name']}: {regression['mean_ms']}ms "
+            f"> {regression['limit_ms']}ms",
+            file=sys.stderr,
+        )
+    return 1 if report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
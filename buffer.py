@@ -20,17 +20,50 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from math import floor
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from math import ceil
+import base64
+import functools
+import hashlib
+import json
+import mmap
 import os
+import queue
 import re
+import shutil
+import string
+import struct
+import subprocess
+import sys
+import threading
+import time
 
 
-import pysrt
 from core.buffer import Buffer
-from core.utils import interactive, message_to_emacs, eval_in_emacs, PostGui
+from core.utils import (
+    interactive,
+    message_to_emacs,
+    eval_in_emacs,
+    get_emacs_config_dir,
+    get_emacs_var,
+    get_emacs_vars,
+    PostGui,
+)
 from PyQt6 import QtCore, QtWidgets
 from PyQt6.QtCore import QEvent, QRectF, QSizeF, Qt, QUrl
-from PyQt6.QtGui import QBrush, QColor, QFont, QPainter
+from PyQt6.QtGui import (
+    QBrush,
+    QColor,
+    QFont,
+    QFontMetricsF,
+    QImage,
+    QPainter,
+    QPainterPath,
+    QPen,
+    QPixmap,
+)
 from PyQt6.QtMultimedia import QAudioOutput, QMediaPlayer
 from PyQt6.QtMultimediaWidgets import QGraphicsVideoItem
 from PyQt6.QtWidgets import (
@@ -42,6 +75,306 @@ from PyQt6.QtWidgets import (
 )
 
 
+class Metrics:
+    """Timing histograms and event counters for the player's hot paths.
+
+    Disabled by default, `timed' code then only pays one attribute check.
+    When a stream file is set, every sample is also appended to it as a
+    JSON line.
+    """
+
+    # Upper bounds of the histogram buckets, in milliseconds.
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000, float("inf"))
+
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}
+        self.counters = {}
+        self.started = {}
+        self.stream = None
+
+    def record(self, name, milliseconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            # count, total, max, histogram
+            timing = self.timings[name] = [0, 0.0, 0.0, [0] * len(self.BUCKETS)]
+        timing[0] += 1
+        timing[1] += milliseconds
+        timing[2] = max(timing[2], milliseconds)
+        timing[3][bisect_left(self.BUCKETS, milliseconds)] += 1
+
+        if self.stream is not None:
+            self.write_sample({"name": name, "ms": round(milliseconds, 3)})
+
+    def count(self, name):
+        if not self.enabled:
+            return
+
+        self.counters[name] = self.counters.get(name, 0) + 1
+        if self.stream is not None:
+            self.write_sample({"name": name})
+
+    def begin(self, name, owner=None):
+        """Start timing NAME, finished by `end'.
+
+        Spans of one name and OWNER, e.g. the VideoPlayer of a buffer, end in
+        FIFO order; spans of different owners never pair up.
+        """
+        if self.enabled:
+            self.started.setdefault((name, owner), deque()).append(time.perf_counter())
+
+    def end(self, name, owner=None):
+        start = self.pop_start(name, owner)
+        if start is not None:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def discard(self, name, owner=None):
+        self.pop_start(name, owner)
+
+    def pop_start(self, name, owner):
+        started = self.started.get((name, owner))
+        if not started:
+            return None
+        start = started.popleft()
+        if not started:
+            # Do not keep closed buffers' owners alive.
+            del self.started[(name, owner)]
+        return start
+
+    def running(self, name, owner=None):
+        return bool(self.started.get((name, owner)))
+
+    def write_sample(self, sample):
+        sample["time"] = time.time()
+        self.stream.write(json.dumps(sample) + "\n")
+
+    def start(self, stream_path=None):
+        self.enabled = True
+        if stream_path:
+            self.stream = open(os.path.expanduser(stream_path), "a", buffering=1)
+
+    def stop(self):
+        self.enabled = False
+        self.started.clear()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def percentile(self, histogram, count, fraction):
+        seen = 0
+        for bound, bucket_count in zip(self.BUCKETS, histogram):
+            seen += bucket_count
+            if seen >= count * fraction:
+                return bound
+        return self.BUCKETS[-1]
+
+    def summary(self):
+        lines = []
+        for name, (count, total, maximum, histogram) in sorted(self.timings.items()):
+            lines.append(
+                f"{name}: n={count} mean={total / count:.3f}ms "
+                f"p50<={self.percentile(histogram, count, 0.5)}ms "
+                f"p95<={self.percentile(histogram, count, 0.95)}ms "
+                f"max={maximum:.3f}ms"
+            )
+        for name, count in sorted(self.counters.items()):
+            lines.append(f"{name}: {count}")
+        return "\n".join(lines) or "No samples."
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    """Record how long the decorated function takes under NAME when metrics are on."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.record(name, (time.perf_counter() - start) * 1000)
+
+        return wrapper
+
+    return decorator
+
+
+class EmacsChannel(QtCore.QObject):
+    """Outbound calls to Emacs, coalesced and batched over a short window.
+
+    A call queued with a KIND replaces the pending call of the same kind from
+    the same OWNER, the VideoPlayer of a buffer, so holding a key that seeks
+    or changes volume only sends the last status. Calls whose every instance
+    matters, such as prefetches, are queued without a kind.
+    Everything pending when the window closes goes out as one message and at
+    most one `eval_in_emacs'. Safe to use from worker threads.
+    """
+
+    queued = QtCore.pyqtSignal()
+
+    def __init__(self, window=40):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.serial = 0
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(window)
+        self.timer.timeout.connect(self.flush)
+        # Starts the timer on the GUI thread, whichever thread queued the call.
+        self.queued.connect(self.schedule)
+
+    def message(self, text, kind=None, owner=None):
+        self.call(None, text, kind=kind, owner=owner)
+
+    def call(self, function, *args, kind=None, owner=None):
+        with self.lock:
+            if kind is None:
+                self.serial += 1
+                key = self.serial
+            else:
+                key = (owner, kind)
+                if self.pending.pop(key, None) is not None:
+                    metrics.count("emacs_rpc.coalesced")
+            self.pending[key] = (function, list(args))
+        self.queued.emit()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            calls = list(self.pending.values())
+            self.pending.clear()
+
+        messages = [args[0] for function, args in calls if function is None]
+        calls = [[function] + args for function, args in calls if function is not None]
+        if messages:
+            metrics.count("emacs_rpc")
+            message_to_emacs(" | ".join(messages))
+        if len(calls) == 1:
+            metrics.count("emacs_rpc")
+            eval_in_emacs(calls[0][0], calls[0][1:])
+        elif calls:
+            metrics.count("emacs_rpc")
+            eval_in_emacs("eaf-video-player--batch", [json.dumps(calls)])
+
+
+emacs_channel = EmacsChannel()
+
+
+def process_memory():
+    """Return the resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+class BufferGovernor:
+    """Release the media and subtitle resources of hidden video buffers.
+
+    Only the `eaf-video-player-max-loaded-hidden-buffers' most recently
+    hidden buffers keep their decoder and subtitles, and none of them longer
+    than `eaf-video-player-hidden-buffer-timeout' seconds. A released
+    buffer keeps its position and track, and reloads when it is shown.
+    """
+
+    def __init__(self):
+        self.players = []
+        self.hidden = OrderedDict()
+        self.timer = None
+
+    def register(self, player):
+        self.players.append(player)
+
+    def unregister(self, player):
+        self.players.remove(player)
+        self.hidden.pop(player, None)
+
+    def player_hidden(self, player):
+        self.hidden[player] = time.monotonic()
+        self.hidden.move_to_end(player)
+        self.enforce()
+
+    def player_shown(self, player):
+        self.hidden.pop(player, None)
+        if player.released:
+            player.restore_resources()
+
+    def enforce(self):
+        # nil, which arrives as False, means no limit and never.
+        max_loaded = get_emacs_var("eaf-video-player-max-loaded-hidden-buffers")
+        timeout = get_emacs_var("eaf-video-player-hidden-buffer-timeout")
+
+        loaded = [player for player in self.hidden if not player.released]
+        if max_loaded is not False and max_loaded is not None:
+            for player in loaded[: max(0, len(loaded) - int(max_loaded))]:
+                self.release(player)
+        if timeout:
+            now = time.monotonic()
+            for player, hidden_time in self.hidden.items():
+                if not player.released and now - hidden_time > timeout:
+                    self.release(player)
+
+        if timeout and any(not player.released for player in self.hidden):
+            if self.timer is None:
+                self.timer = QtCore.QTimer()
+                self.timer.timeout.connect(self.enforce)
+            self.timer.start(int(min(timeout, 60) * 1000))
+        elif self.timer is not None:
+            self.timer.stop()
+
+    def release(self, player):
+        player.release_resources()
+        # Forget parsed timelines no loaded buffer still shows.
+        in_use = {
+            os.path.abspath(player.subtitles.subtitle_url)
+            for player in self.players
+            if not player.released and player.subtitles.subtitle_url
+        }
+        with loaded_timelines_lock:
+            for key in [key for key in loaded_timelines if key[0] not in in_use]:
+                del loaded_timelines[key]
+
+    def report(self):
+        lines = []
+        rss = process_memory()
+        if rss is not None:
+            lines.append(f"process: {format_size(rss)} resident")
+        for player in self.players:
+            usage = player.memory_usage()
+            state = "released" if player.released else "loaded"
+            if player in self.hidden:
+                state += ", hidden"
+            lines.append(
+                f"{os.path.basename(player.url or '')} ({state}): "
+                + " ".join(
+                    f"{name}={format_size(size)}" for name, size in usage.items()
+                )
+            )
+        return "\n".join(lines)
+
+
+buffer_governor = BufferGovernor()
+
+
 class AppBuffer(Buffer):
     def __init__(self, buffer_id, url, arguments):
         Buffer.__init__(self, buffer_id, url, arguments, True)
@@ -51,6 +384,7 @@ class AppBuffer(Buffer):
         self.add_widget(
             VideoPlayer(self.theme_background_color, self.theme_foreground_color)
         )
+        self.buffer_widget.buffer_id = buffer_id
         self.buffer_widget.play(url)
 
         self.build_all_methods(self.buffer_widget)
@@ -63,17 +397,18 @@ class AppBuffer(Buffer):
         ):
             self.buffer_widget.media_player.pause()
             self.buffer_widget.video_need_replay = True
+        buffer_governor.player_hidden(self.buffer_widget)
 
     def some_view_show(self):
+        buffer_governor.player_shown(self.buffer_widget)
         if self.buffer_widget.video_need_replay is True:
             self.buffer_widget.media_player.play()
 
     def save_session_data(self):
-        return str(self.buffer_widget.media_player.position())
+        return self.buffer_widget.session_data()
 
     def restore_session_data(self, session_data):
-        position = int(session_data)
-        self.buffer_widget.media_player.setPosition(position)
+        self.buffer_widget.restore_session(session_data)
 
     def toggle_play(self):
         if (
@@ -88,6 +423,10 @@ class AppBuffer(Buffer):
 
     def destroy_buffer(self):
         self.buffer_widget.media_player.pause()
+        self.buffer_widget.subtitles.rasterizer.stop()
+        self.buffer_widget.thumbnail_generator.cancel()
+        self.buffer_widget.chapter_analyzer.cancel()
+        buffer_governor.unregister(self.buffer_widget)
 
         super().destroy_buffer()
 
@@ -107,11 +446,74 @@ class AppBuffer(Buffer):
         event.accept()
 
     @PostGui()
-    def message_box_update(self, text, x, y):
-        # print(self.buffer_widget.message_box)
-        message_box = self.buffer_widget.message_box
+    def open_subtitle_track(self, name):
+        subtitles = self.buffer_widget.subtitles
+        for path in subtitles.candidates:
+            if os.path.basename(path) == name:
+                subtitles.open_track(path)
+                break
+
+    @PostGui()
+    def open_embedded_subtitle(self, label):
+        subtitles = self.buffer_widget.subtitles
+        for stream in subtitles.embedded_streams:
+            if EmbeddedSubtitles.label(stream) == label:
+                emacs_channel.message(f"Extracting subtitle {label}.")
+                subtitles.embedded.extract(subtitles.video_url, stream)
+                break
+
+    @PostGui()
+    def search_subtitle_index(self, query):
+        results = self.buffer_widget.subtitles.search(query)
+        if results:
+            emacs_channel.call(
+                "eaf-video-player--navigate-by-subtitles",
+                query,
+                results,
+                kind="search",
+                owner=self.buffer_widget,
+            )
+        else:
+            emacs_channel.message(
+                f"No subtitle matches {query}.", kind="search", owner=self.buffer_widget
+            )
+
+    @PostGui()
+    def seek_to_subtitle(self, candidate):
+        position = parse_timestamp(candidate.split(" ", 1)[0])
+        self.buffer_widget.seek_scheduler.seek(position)
+        emacs_channel.message(
+            f"Jump to: {candidate}", kind="position", owner=self.buffer_widget
+        )
+
+    @PostGui()
+    def message_box_update(self, text, x, y, word=None):
+        # Word lookups name their word, sentence explanations do not.
+        if word is not None and not self.buffer_widget.subtitles.lookup_done(
+            word, text
+        ):
+            return
+        message_box = self.buffer_widget.ensure_message_box()
         message_box.update(text, x, y)
 
+    @PostGui()
+    def lookup_cache_fill(self, results):
+        metrics.end("prefetch_rpc", self.buffer_widget)
+        for word, text in json.loads(results).items():
+            lookup_cache.put(word, text)
+
+
+# Read by VideoPlayer and Subtitles with one `get_emacs_vars' call.
+STARTUP_SETTINGS = [
+    "eaf-video-player-frame-ring-size",
+    "eaf-video-player-frame-ring-memory",
+    "eaf-video-player-subtitle-download-languages",
+    "eaf-video-player-subtitle-lookahead",
+    "eaf-video-player-subtitle-cache-size",
+    "eaf-video-player-subtitle-languages",
+    "eaf-video-player-lookup-prefetch",
+]
+
 
 class VideoPlayer(QWidget):
     def __init__(self, theme_background_color, theme_foreground_color):
@@ -140,80 +542,339 @@ class VideoPlayer(QWidget):
         self.panel_padding_x = 0
         self.panel_padding_y = (self.panel_height - self.progress_bar_height) / 2
 
-        self.control_panel_widget = QWidget()
-        self.control_panel_widget.setStyleSheet("background-color: transparent;")
-        self.progress_bar_layout = QHBoxLayout(self.control_panel_widget)
-        self.progress_bar_layout.setContentsMargins(
-            int(self.panel_padding_x),
-            int(self.panel_padding_y),
-            int(self.panel_padding_x),
-            int(self.panel_padding_x),
-        )
-
-        self.control_panel = ControlPanel()
+        self.theme_background_color = theme_background_color
+        self.theme_foreground_color = theme_foreground_color
 
-        self.progress_bar = ProgressBar(theme_background_color, theme_foreground_color)
-        self.progress_bar.progress_changed.connect(self.update_video_progress)
-        self.progress_bar_layout.addWidget(self.progress_bar)
+        # Overlays are built on first use, see `build_control_panel',
+        # `ensure_message_box' and `show_thumbnail'.
+        self.control_panel = None
+        self.progress_bar = None
+        self.control_panel_visible = False
+        self.message_box = None
+        self.thumbnail_item = None
 
         self.layout = QVBoxLayout(self)
         self.layout.setContentsMargins(0, 0, 0, 0)
         self.layout.addWidget(self.graphics_view)
 
+        # Every setting needed before playback starts, in one round trip.
+        self.settings = dict(zip(STARTUP_SETTINGS, get_emacs_vars(STARTUP_SETTINGS)))
+
         self.subtitles = Subtitles(self)
-        self.message_box = MessageBox(self)
 
         self.scene.addItem(self.video_item)
-        self.scene.addItem(self.control_panel)
         self.scene.addItem(self.subtitles)
-        self.scene.addItem(self.message_box)
+        # Stacking: video, stepped frame, control panel, subtitles, popups.
+        self.video_item.setZValue(-2)
+        self.subtitles.setZValue(1)
 
-        self.control_panel_proxy_widget = self.scene.addWidget(
-            self.control_panel_widget
-        )
+        self.thumbnail_sprite = None
+        self.thumbnail_generator = ThumbnailGenerator()
+        self.thumbnail_generator.finished.connect(self.thumbnails_ready)
+        self.chapters = []
+        self.chapter_analyzer = ChapterAnalyzer()
+        self.chapter_analyzer.progress.connect(self.chapters_found)
 
         self.media_player = QMediaPlayer()
         self.audio_output = QAudioOutput()
+        self.connect_media_player(self.media_player)
 
-        self.media_player.positionChanged.connect(self.progress_change)
-        self.media_player.setVideoOutput(self.video_item)
-        self.media_player.setAudioOutput(self.audio_output)
+        self.seek_scheduler = SeekScheduler(self.media_player)
+        self.cue_scheduler = CueScheduler(self)
+        self.frame_stepper = FrameStepper(
+            self,
+            int(self.settings["eaf-video-player-frame-ring-size"]),
+            int(self.settings["eaf-video-player-frame-ring-memory"]) * 1024 * 1024,
+        )
 
+        self.url = None
+        # Set by AppBuffer, Emacs replies are addressed to it.
+        self.buffer_id = None
+        self.playlist = []
+        self.playlist_index = 0
+        self.playlist_positions = {}
+        self.standby_player = None
+        self.pending_position = None
+        self.released = False
+        self.released_position = 0
         self.video_need_replay = False
         self.video_seek_durcation = 10000  # in milliseconds
+        self.loop_start = None
+        self.silence_skip = False
+        self.silence_detector = SilenceDetector()
+        self.silence_detector.found.connect(self.silence_found)
+        self.silence_detector.failed.connect(self.silence_failed)
+        self.download_languages = self.settings[
+            "eaf-video-player-subtitle-download-languages"
+        ]
 
-        QtCore.QTimer().singleShot(2000, self.hide_control_panel)
+        self.first_frame_start = None
 
         self.graphics_view.viewport().installEventFilter(self)
 
+        buffer_governor.register(self)
+
     def update_video_progress(self, percent):
-        self.media_player.setPosition(int(self.media_player.duration() * percent))
+        self.seek_scheduler.seek(self.media_player.duration() * percent, precise=False)
+
+    def finish_video_progress(self, percent):
+        position = self.media_player.duration() * percent
+        coalesced = self.seek_scheduler.finish_scrub(position)
+        emacs_channel.message(
+            f"Seek to: {format_srt_time(position)} ({coalesced} seeks coalesced)",
+            kind="position",
+            owner=self,
+        )
+
+    def connect_media_player(self, media_player):
+        media_player.positionChanged.connect(self.progress_change)
+        media_player.durationChanged.connect(self.duration_change)
+        media_player.mediaStatusChanged.connect(self.media_status_change)
+        media_player.setVideoOutput(self.video_item)
+        media_player.setAudioOutput(self.audio_output)
+
+    def swap_media_player(self, media_player):
+        old_player = self.media_player
+        old_player.positionChanged.disconnect(self.progress_change)
+        old_player.durationChanged.disconnect(self.duration_change)
+        old_player.mediaStatusChanged.disconnect(self.media_status_change)
+        old_player.stop()
+        old_player.setVideoOutput(None)
+        old_player.setAudioOutput(None)
+        old_player.deleteLater()
+
+        self.media_player = media_player
+        self.connect_media_player(media_player)
+        self.seek_scheduler.attach(media_player)
+        self.cue_scheduler.attach(media_player)
+        self.frame_stepper.attach(media_player)
+
+    def media_status_change(self, status):
+        if self.pending_position is not None and status in (
+            QMediaPlayer.MediaStatus.LoadedMedia,
+            QMediaPlayer.MediaStatus.BufferedMedia,
+        ):
+            self.media_player.setPosition(self.pending_position)
+            self.pending_position = None
+
+        if (
+            status == QMediaPlayer.MediaStatus.EndOfMedia
+            and self.playlist_index + 1 < len(self.playlist)
+        ):
+            self.switch_to_item(self.playlist_index + 1, finished=True)
+
+        metrics.count(f"media_status.{status.name}")
+        if status in (
+            QMediaPlayer.MediaStatus.BufferingMedia,
+            QMediaPlayer.MediaStatus.StalledMedia,
+        ):
+            if not metrics.running("buffering", self):
+                metrics.begin("buffering", self)
+        elif status == QMediaPlayer.MediaStatus.BufferedMedia:
+            metrics.end("buffering", self)
+
+    def duration_change(self, duration):
+        source = self.media_player.source()
+        self.thumbnail_sprite = None
+        self.chapters = []
+        if self.progress_bar is not None:
+            self.progress_bar.set_ticks(self.chapters)
+        if duration > 0 and source.isLocalFile():
+            self.thumbnail_generator.start(source.toLocalFile(), duration)
+            self.chapter_analyzer.start(source.toLocalFile(), duration)
+
+    def chapters_found(self, path, index):
+        if path != self.media_player.source().toLocalFile():
+            return
+        self.chapters = index.chapters(
+            int(get_emacs_var("eaf-video-player-chapter-min-length")) * 1000
+        )
+        if self.progress_bar is not None:
+            self.progress_bar.set_ticks(self.chapters)
+
+    def thumbnails_ready(self, sprite):
+        if sprite.path == self.media_player.source().toLocalFile():
+            self.thumbnail_sprite = sprite
+
+    def show_thumbnail(self, percent):
+        if percent < 0 or self.thumbnail_sprite is None:
+            if self.thumbnail_item is not None:
+                self.thumbnail_item.hide()
+            return
+
+        if self.thumbnail_item is None:
+            self.thumbnail_item = QtWidgets.QGraphicsPixmapItem()
+            self.thumbnail_item.setZValue(2)
+            self.scene.addItem(self.thumbnail_item)
+
+        image = self.thumbnail_sprite.thumbnail(self.media_player.duration() * percent)
+        self.thumbnail_item.setPixmap(QPixmap.fromImage(image))
+
+        x = self.panel_padding_x + self.progress_bar.width() * percent
+        x = min(max(x - image.width() / 2, 0), self.width() - image.width())
+        y = self.height() - self.panel_height - image.height()
+        self.thumbnail_item.setPos(x, y)
+        self.thumbnail_item.show()
 
     def progress_change(self, position):
-        self.progress_bar.update_progress(self.media_player.duration(), position)
-        self.subtitles.update_subtitle(position)
+        duration = self.media_player.duration()
+        if (
+            self.playlist
+            and self.standby_player is None
+            and self.playlist_index + 1 < len(self.playlist)
+            and 0 < duration - position < PLAYLIST_PRELOAD
+        ):
+            self.prepare_next_item()
+
+        if self.control_panel_visible:
+            self.progress_bar.update_progress(self.media_player.duration(), position)
+        self.cue_scheduler.position_changed(position)
 
     def resizeEvent(self, event):
         self.video_item.setSize(QSizeF(event.size().width(), event.size().height()))
+        if self.control_panel is not None:
+            self.layout_control_panel(event.size().width(), event.size().height())
+
+        self.subtitles.resize_view()
+
+        QWidget.resizeEvent(self, event)
+
+    def build_control_panel(self):
+        self.control_panel_widget = QWidget()
+        self.control_panel_widget.setStyleSheet("background-color: transparent;")
+        self.progress_bar_layout = QHBoxLayout(self.control_panel_widget)
+        self.progress_bar_layout.setContentsMargins(
+            int(self.panel_padding_x),
+            int(self.panel_padding_y),
+            int(self.panel_padding_x),
+            int(self.panel_padding_x),
+        )
+
+        self.control_panel = ControlPanel()
 
-        self.control_panel.update_size(event.size().width(), self.panel_height)
-        self.control_panel.setPos(0, event.size().height() - self.panel_height)
+        self.progress_bar = ProgressBar(
+            self.theme_background_color, self.theme_foreground_color
+        )
+        self.progress_bar.progress_changed.connect(self.update_video_progress)
+        self.progress_bar.progress_released.connect(self.finish_video_progress)
+        self.progress_bar.hover_changed.connect(self.show_thumbnail)
+        self.progress_bar.set_ticks(self.chapters)
+        self.progress_bar_layout.addWidget(self.progress_bar)
 
-        self.control_panel_widget.resize(event.size().width(), self.panel_height)
-        self.control_panel_proxy_widget.setPos(
-            0, event.size().height() - self.panel_height
+        self.scene.addItem(self.control_panel)
+        self.control_panel_proxy_widget = self.scene.addWidget(
+            self.control_panel_widget
         )
+        self.control_panel.hide()
+        self.control_panel_proxy_widget.hide()
+        self.layout_control_panel(self.width(), self.height())
+
+    def layout_control_panel(self, width, height):
+        self.control_panel.update_size(width, self.panel_height)
+        self.control_panel.setPos(0, height - self.panel_height)
+
+        self.control_panel_widget.resize(width, self.panel_height)
+        self.control_panel_proxy_widget.setPos(0, height - self.panel_height)
 
         self.progress_bar.resize(
-            event.size().width() - self.panel_padding_x * 2, self.progress_bar_height
+            width - self.panel_padding_x * 2, self.progress_bar_height
         )
 
-        QWidget.resizeEvent(self, event)
+    def ensure_message_box(self):
+        if self.message_box is None:
+            self.message_box = MessageBox(self)
+            self.message_box.setZValue(2)
+            self.scene.addItem(self.message_box)
+        return self.message_box
+
+    def wait_first_frame(self):
+        """Measure the time from now until the video sink gets a frame."""
+        if self.first_frame_start is None:
+            self.video_item.videoSink().videoFrameChanged.connect(self.first_frame)
+        self.first_frame_start = time.perf_counter()
+
+    def first_frame(self, frame):
+        if not frame.isValid():
+            return
+
+        self.video_item.videoSink().videoFrameChanged.disconnect(self.first_frame)
+        metrics.record(
+            "time_to_first_frame", (time.perf_counter() - self.first_frame_start) * 1000
+        )
+        self.first_frame_start = None
+
+        # The control panel is shown briefly once the video is up.
+        if self.control_panel is None:
+            self.build_control_panel()
+            self.show_control_panel()
+            QtCore.QTimer().singleShot(2000, self.hide_control_panel)
 
     def play(self, url):
-        self.subtitles.open(url)
-        self.media_player.setSource(QUrl.fromLocalFile(url))
+        playlist = read_playlist(url)
+        if playlist is not None:
+            if not playlist:
+                emacs_channel.message(f"No videos in {url}.")
+                return
+            self.playlist = playlist
+            self.playlist_index = 0
+            url = playlist[0]
+
+        # Start the media first, subtitles are found and parsed in the background.
+        self.url = url
+        self.wait_first_frame()
+        self.load_source(url)
         self.media_player.play()
+        self.subtitles.open(url)
+        self.find_silence()
+
+    def source_url(self, url):
+        if is_remote_url(url):
+            # Remote media is read through the local read-ahead cache.
+            return QUrl(media_cache_proxy().proxy_url(url))
+        return QUrl.fromLocalFile(url)
+
+    def load_source(self, url):
+        self.media_player.setSource(self.source_url(url))
+
+    def position(self):
+        if self.released:
+            return self.released_position
+        return self.media_player.position()
+
+    def release_resources(self):
+        """Unload the media and subtitles, keeping only the position and track."""
+        self.released_position = self.media_player.position()
+        self.released = True
+
+        if self.standby_player is not None:
+            self.standby_player.deleteLater()
+            self.standby_player = None
+        self.media_player.stop()
+        self.media_player.setSource(QUrl())
+
+        self.frame_stepper.stop(sync=False)
+        self.thumbnail_generator.cancel()
+        self.chapter_analyzer.cancel()
+        self.thumbnail_sprite = None
+        if self.thumbnail_item is not None:
+            self.thumbnail_item.hide()
+            self.thumbnail_item.setPixmap(QPixmap())
+
+        self.subtitles.release()
+
+    def restore_resources(self):
+        self.released = False
+        self.subtitles.restore()
+        self.load_source(self.url)
+        if self.released_position:
+            self.pending_position = self.released_position
+
+    def memory_usage(self):
+        """Estimate the bytes held by this buffer, the decoder is not counted."""
+        usage = self.subtitles.memory_usage()
+        if self.thumbnail_sprite is not None:
+            usage["thumbnails"] = self.thumbnail_sprite.image.sizeInBytes()
+        return usage
 
     def eventFilter(self, obj, event):
         if event.type() in [QEvent.Type.MouseButtonPress]:
@@ -222,335 +883,3788 @@ class VideoPlayer(QWidget):
             self.is_button_press = False
 
         if event.type() == QEvent.Type.MouseMove:
-            if event.position().y() > self.height() - self.progress_bar_height:
-                self.show_control_panel()
-            else:
-                self.hide_control_panel()
+            in_panel = event.position().y() > self.height() - self.progress_bar_height
+            if in_panel != self.control_panel_visible:
+                if in_panel:
+                    self.show_control_panel()
+                else:
+                    self.hide_control_panel()
 
         return False
 
     def hide_control_panel(self):
-        self.control_panel.hide()
-        self.control_panel_proxy_widget.hide()
+        self.control_panel_visible = False
+        if self.control_panel is not None:
+            self.control_panel.hide()
+            self.control_panel_proxy_widget.hide()
 
     def show_control_panel(self):
+        if self.control_panel is None:
+            self.build_control_panel()
+        self.control_panel_visible = True
+        # Progress ticks were not painted while hidden.
+        self.progress_bar.update_progress(
+            self.media_player.duration(), self.media_player.position()
+        )
         self.control_panel.show()
         self.control_panel_proxy_widget.show()
 
-    def download_subtitles_thread(self, url):
-        """Subtitle download function executed in multiple processes"""
-        from babelfish import Language
-        from subliminal import (
-            download_best_subtitles,
-            region,
-            save_subtitles,
-            scan_video,
-        )
+    @PostGui()
+    def subtitles_downloaded(self, video_path, subtitle_paths, error):
+        if video_path != self.media_player.source().toLocalFile():
+            return
 
-        try:
-            # Configure Cache
-            region.configure(
-                "dogpile.cache.dbm",
-                arguments={"filename": "cachefile.dbm"},
-                replace_existing_backend=True,
+        if error is not None:
+            emacs_channel.message(f"Error downloading subtitles: {error}")
+        elif not subtitle_paths:
+            emacs_channel.message("No subtitles found.")
+        else:
+            # Hot-load the download, no `reload_subtitles' needed.
+            self.subtitles.candidates = find_subtitle_files(
+                video_path, self.subtitles.languages
             )
+            self.subtitles.open_track(subtitle_paths[0])
+            emacs_channel.message("Subtitle download complete.")
 
-            # Scan Video
-            video = scan_video(url)
+    @interactive
+    def search_subtitles(self):
+        if not len(self.subtitles.timeline):
+            emacs_channel.message("There is no subtitles.", kind="subtitle", owner=self)
+            return
+        emacs_channel.call("eaf-video-player--search-subtitles")
 
-            # Download the best subtitles.
-            subtitles = download_best_subtitles([video], {Language("eng")})
+    @interactive
+    def play_forward_subtitle(self):
+        timeline = self.subtitles.timeline
+        index = timeline.next_index(self.seek_scheduler.position())
+        if index is None:
+            emacs_channel.message("No more subtitles.", kind="position", owner=self)
+            return
+        start = timeline.starts[index]
+        self.seek_scheduler.seek(start)
+        emacs_channel.message(
+            f"Forward to: {format_srt_time(start)}", kind="position", owner=self
+        )
 
-            # Save subtitles to disk
-            save_subtitles(video, subtitles[video])
-            print("Subtitle download complete.")
-            message_to_emacs("Subtitle download complete.")
+    @interactive
+    def play_backward_subtitle(self):
+        timeline = self.subtitles.timeline
+        index = timeline.previous_index(self.seek_scheduler.position())
+        if index is None:
+            emacs_channel.message("No more subtitles.", kind="position", owner=self)
+            return
+        start = timeline.starts[index]
+        self.seek_scheduler.seek(start)
+        emacs_channel.message(
+            f"Backward to: {format_srt_time(start)}", kind="position", owner=self
+        )
 
-        except Exception as e:
-            print(f"Error downloading subtitles: {e}")
-            message_to_emacs(f"Error downloading subtitles: {e}")
+    @interactive
+    def play_next_chapter(self):
+        index = bisect_right(self.chapters, self.seek_scheduler.position() + 500)
+        if index == len(self.chapters):
+            emacs_channel.message("No more chapters.", kind="position", owner=self)
+            return
+        self.seek_to_chapter(index)
 
     @interactive
-    def play_forward_subtitle(self):
-        subs = self.subtitles.subs
-        current_sub = self.subtitles.current_sub
-        # The index starts from 1 in subtitles, but the index of the array starts from 0.
-        index = min(len(subs), current_sub.index)
-        start = subs[index].start
-        self.media_player.setPosition(floor(self.subtitles.parse_srt_time(start)))
-        message_to_emacs(f"Forward to: {start}")
+    def play_previous_chapter(self):
+        # Like a chapter skip button: back to the start of the current chapter,
+        # or to the one before when already close to its start.
+        index = bisect_right(self.chapters, self.seek_scheduler.position() - 3000) - 1
+        if index < 0:
+            self.seek_scheduler.seek(0)
+            emacs_channel.message("Backward to: start", kind="position", owner=self)
+            return
+        self.seek_to_chapter(index)
+
+    def seek_to_chapter(self, index):
+        start = self.chapters[index]
+        self.seek_scheduler.seek(start)
+        emacs_channel.message(
+            f"Chapter {index + 2}/{len(self.chapters) + 1}: {format_srt_time(start)}",
+            kind="position",
+            owner=self,
+        )
+
+    def current_cue(self):
+        """Index of the cue at the playhead, or the last one before it, or None."""
+        timeline = self.subtitles.timeline
+        position = self.seek_scheduler.position()
+        cues = timeline.active(position)
+        if cues:
+            return cues[-1]
+        index = timeline.seek_index(position)
+        return index if index >= 0 else None
 
     @interactive
-    def play_backward_subtitle(self):
-        subs = self.subtitles.subs
-        current_sub = self.subtitles.current_sub
-        # The index starts from 1 in subtitles, but the index of the array starts from 0.
-        index = max(0, current_sub.index - 2)
-        start = subs[index].start
-        self.media_player.setPosition(floor(self.subtitles.parse_srt_time(start)))
-        message_to_emacs(f"Forward to: {start}")
+    def toggle_sentence_repeat(self):
+        if self.cue_scheduler.loop is not None:
+            self.cue_scheduler.loop = None
+            emacs_channel.message("Repeat off.", kind="repeat", owner=self)
+            return
+
+        index = self.current_cue()
+        if index is None:
+            emacs_channel.message("No subtitle to repeat.", kind="repeat", owner=self)
+            return
+
+        timeline = self.subtitles.timeline
+        self.cue_scheduler.loop = (timeline.starts[index], timeline.ends[index])
+        self.seek_scheduler.seek(timeline.starts[index])
+        emacs_channel.message(
+            f"Repeat: {timeline.texts[index]}", kind="repeat", owner=self
+        )
 
     @interactive
-    def play_forward(self):
-        video_position = self.media_player.position()
-        self.media_player.setPosition(video_position + self.video_seek_durcation)
-        message_to_emacs(
-            "Forward to: {}%".format(
-                self.media_player.position() / self.media_player.duration() * 100
+    def set_ab_loop(self):
+        """Mark loop start, then loop end, on cue boundaries; a third call clears the loop."""
+        timeline = self.subtitles.timeline
+        index = self.current_cue()
+        if self.cue_scheduler.loop is not None:
+            self.cue_scheduler.loop = None
+            self.loop_start = None
+            emacs_channel.message("A/B loop off.", kind="repeat", owner=self)
+        elif index is None:
+            emacs_channel.message("No subtitle to loop.", kind="repeat", owner=self)
+        elif self.loop_start is None:
+            self.loop_start = timeline.starts[index]
+            emacs_channel.message(
+                f"A/B loop start: {format_srt_time(self.loop_start)}",
+                kind="repeat",
+                owner=self,
+            )
+        else:
+            start = min(self.loop_start, timeline.starts[index])
+            end = max(self.loop_start, timeline.ends[index])
+            self.cue_scheduler.loop = (start, end)
+            self.loop_start = None
+            self.seek_scheduler.seek(start)
+            emacs_channel.message(
+                f"A/B loop: {format_srt_time(start)} - {format_srt_time(end)}",
+                kind="repeat",
+                owner=self,
             )
+
+    @interactive
+    def play_forward(self):
+        video_position = self.seek_scheduler.position()
+        position = self.seek_scheduler.seek(video_position + self.video_seek_durcation)
+        emacs_channel.message(
+            "Forward to: {}%".format(position / self.media_player.duration() * 100),
+            kind="position",
+            owner=self,
         )
 
     @interactive
     def play_backward(self):
-        video_position = self.media_player.position()
-        self.media_player.setPosition(
-            max(video_position - self.video_seek_durcation, 0)
+        video_position = self.seek_scheduler.position()
+        position = self.seek_scheduler.seek(video_position - self.video_seek_durcation)
+        emacs_channel.message(
+            "Backward to: {}%".format(position / self.media_player.duration() * 100),
+            kind="position",
+            owner=self,
         )
-        message_to_emacs(
-            "Forward to: {}%".format(
-                self.media_player.position() / self.media_player.duration() * 100
+
+    @interactive
+    def toggle_silence_skip(self):
+        self.silence_skip = not self.silence_skip
+        if self.silence_skip:
+            if is_remote_url(self.url):
+                self.silence_skip = False
+                emacs_channel.message("Silence skipping only works on local videos.")
+                return
+            emacs_channel.message("Finding silent spans.", kind="silence", owner=self)
+        else:
+            emacs_channel.message("Silence skipping off.", kind="silence", owner=self)
+        self.find_silence()
+
+    def find_silence(self):
+        self.cue_scheduler.set_silence(None)
+        if self.silence_skip and not is_remote_url(self.url):
+            self.silence_detector.start(
+                self.url,
+                int(get_emacs_var("eaf-video-player-silence-min-duration")),
+                int(get_emacs_var("eaf-video-player-silence-threshold")),
             )
+
+    def silence_found(self, video_path, silence):
+        if not self.silence_skip or video_path != self.url:
+            return
+        self.cue_scheduler.set_silence(
+            silence, get_emacs_var("eaf-video-player-silence-rate")
         )
+        emacs_channel.message(
+            f"Skipping {len(silence)} silent spans, {silence.total() / 1000:.0f}s in total.",
+            kind="silence",
+            owner=self,
+        )
+
+    def silence_failed(self, video_path, error):
+        if video_path == self.url:
+            self.silence_skip = False
+            emacs_channel.message(error, kind="silence", owner=self)
+
+    @interactive
+    def step_frame_forward(self):
+        self.frame_stepper.step(1)
+
+    @interactive
+    def step_frame_backward(self):
+        self.frame_stepper.step(-1)
 
     @interactive
     def increase_volume(self):
         self.audio_output.setVolume(self.audio_output.volume() + 0.1)
-        message_to_emacs(
-            "Increase volume to: {}%".format(self.audio_output.volume() * 100)
+        emacs_channel.message(
+            "Increase volume to: {}%".format(self.audio_output.volume() * 100),
+            kind="volume",
+            owner=self,
         )
 
     @interactive
     def decrease_volume(self):
         self.audio_output.setVolume(self.audio_output.volume() - 0.1)
-        message_to_emacs(
-            "Decrease volume to: {}%".format(self.audio_output.volume() * 100)
+        emacs_channel.message(
+            "Decrease volume to: {}%".format(self.audio_output.volume() * 100),
+            kind="volume",
+            owner=self,
         )
 
     @interactive
     def download_subtitles(self):
-        import threading
+        if is_remote_url(self.url):
+            emacs_channel.message("Subtitles can only be downloaded for local videos.")
+            return
+
+        video_path = self.media_player.source().toLocalFile()
+        if subtitle_downloader.download(
+            video_path, self.download_languages, self.subtitles_downloaded
+        ):
+            emacs_channel.message("Downloading subtitle.")
+        else:
+            emacs_channel.message("Subtitle download already in progress.")
+
+    @interactive
+    def download_directory_subtitles(self):
+        if is_remote_url(self.url):
+            emacs_channel.message("Subtitles can only be downloaded for local videos.")
+            return
+
+        directory = os.path.dirname(self.media_player.source().toLocalFile())
+        video_paths = list_video_files(directory)
+        remaining = [len(video_paths)]
 
-        message_to_emacs("Downloading subtitle.")
-        # Retrieve video path
-        url = self.media_player.source().path()
-        thread = threading.Thread(target=self.download_subtitles_thread, args=(url,))
-        thread.start()
+        def downloaded(video_path, subtitle_paths, error):
+            self.subtitles_downloaded(video_path, subtitle_paths, error)
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                emacs_channel.message(f"Subtitle download complete for {directory}.")
+
+        for video_path in video_paths:
+            if not subtitle_downloader.download(
+                video_path, self.download_languages, downloaded
+            ):
+                remaining[0] -= 1
+        emacs_channel.message(f"Downloading subtitles for {remaining[0]} videos.")
 
     @interactive
     def reload_subtitles(self):
-        url = self.media_player.source().path()
+        url = self.url
         self.subtitles.open(url)
 
-    @interactive
-    def restart(self):
-        self.media_player.setPosition(0)
+    def session_data(self):
+        if not self.playlist:
+            return str(self.position())
 
+        self.playlist_positions[self.url] = self.position()
+        return json.dumps(
+            {
+                "playlist": self.playlist,
+                "index": self.playlist_index,
+                "positions": self.playlist_positions,
+            }
+        )
 
-class ControlPanel(QtWidgets.QGraphicsItem):
-    def __init__(self, parent=None):
-        super(ControlPanel, self).__init__(parent)
-        self.height = 0
-        self.width = 0
-        self.background_color = QColor(0, 0, 0, 255)
-        self.setOpacity(0.9)
+    def restore_session(self, session_data):
+        try:
+            self.media_player.setPosition(int(session_data))
+            return
+        except ValueError:
+            state = json.loads(session_data)
 
-    def update_size(self, width, height):
-        self.width = width
-        self.height = height
-        self.update()
+        self.playlist_positions = state["positions"]
+        if not self.playlist:
+            self.playlist = state["playlist"]
+        index = min(state["index"], len(self.playlist) - 1)
+        if index != self.playlist_index:
+            self.switch_to_item(index, restoring=True)
+        else:
+            self.pending_position = self.playlist_positions.get(self.url)
 
-    def paint(self, painter, option, widget):
-        painter.setPen(self.background_color)
-        painter.setBrush(self.background_color)
-        painter.drawRect(0, 0, self.width, self.height)
+    def prepare_next_item(self):
+        """Load the next playlist item into a standby player and parse its subtitles."""
+        path = self.playlist[self.playlist_index + 1]
+        self.standby_player = QMediaPlayer()
+        self.standby_player.setSource(self.source_url(path))
+        if is_remote_url(path):
+            return
+        threading.Thread(
+            target=preload_subtitles,
+            args=(path, self.subtitles.languages),
+            daemon=True,
+        ).start()
 
-    def boundingRect(self):
-        return QRectF(0, 0, self.width, self.height)
+    def switch_to_item(self, index, finished=False, restoring=False):
+        # While restoring, the outgoing item has only just opened, keep the
+        # position the session recorded for it.
+        if not restoring:
+            self.playlist_positions[self.url] = (
+                0 if finished else self.media_player.position()
+            )
 
+        path = self.playlist[index]
+        media_player = self.standby_player
+        self.standby_player = None
+        source = self.source_url(path)
+        if media_player is None or media_player.source() != source:
+            if media_player is not None:
+                media_player.deleteLater()
+            media_player = QMediaPlayer()
+            media_player.setSource(source)
 
-class ProgressBar(QWidget):
-    progress_changed = QtCore.pyqtSignal(float)
+        self.wait_first_frame()
+        self.swap_media_player(media_player)
+        self.playlist_index = index
+        self.url = path
+        self.subtitles.open(path)
+        self.find_silence()
 
-    def __init__(self, theme_background_color, theme_foreground_color):
-        super(QWidget, self).__init__()
-        self.foreground_color = QColor(theme_foreground_color)
-        self.background_color = QColor(theme_background_color)
-        self.position = 0
-        self.duration = 0
-        self.is_press = False
-        self.render_height = 10
+        position = self.playlist_positions.get(path)
+        if position:
+            if media_player.mediaStatus() in (
+                QMediaPlayer.MediaStatus.LoadedMedia,
+                QMediaPlayer.MediaStatus.BufferedMedia,
+            ):
+                media_player.setPosition(position)
+            else:
+                self.pending_position = position
 
-    def update_progress(self, duration, position):
+        media_player.play()
+        if media_player.duration() > 0:
+            self.duration_change(media_player.duration())
+        emacs_channel.message(
+            f"Playing {os.path.basename(path)} ({index + 1}/{len(self.playlist)})",
+            kind="playlist",
+            owner=self,
+        )
+
+    def step_playlist(self, step):
+        if not self.playlist:
+            if is_remote_url(self.url):
+                emacs_channel.message("Not playing a playlist.")
+                return
+            # Start a playlist over the directory of the current video.
+            self.playlist = list_video_files(os.path.dirname(self.url))
+            if self.url not in self.playlist:
+                # Its extension isn't in `eaf-video-extension-list'.
+                insort(self.playlist, self.url)
+            self.playlist_index = self.playlist.index(self.url)
+
+        index = self.playlist_index + step
+        if 0 <= index < len(self.playlist):
+            self.switch_to_item(index)
+        else:
+            emacs_channel.message("No more videos.", kind="playlist", owner=self)
+
+    @interactive
+    def play_next_item(self):
+        self.step_playlist(1)
+
+    @interactive
+    def play_previous_item(self):
+        self.step_playlist(-1)
+
+    @interactive
+    def select_subtitle_track(self):
+        candidates = [os.path.basename(path) for path in self.subtitles.candidates]
+        if candidates:
+            emacs_channel.call(
+                "eaf-video-player--select-subtitle-track",
+                "open_subtitle_track",
+                *candidates,
+            )
+        else:
+            emacs_channel.message("There is no subtitles.", kind="subtitle", owner=self)
+
+    @interactive
+    def auto_sync_subtitles(self):
+        subtitles = self.subtitles
+        if is_remote_url(self.url):
+            emacs_channel.message(
+                "Subtitles can only be synchronized for local videos."
+            )
+        elif not len(subtitles.timeline):
+            emacs_channel.message("There is no subtitles.", kind="subtitle", owner=self)
+        elif subtitles.sync.start(
+            self.url,
+            subtitles.subtitle_url,
+            subtitles.timeline,
+            bool(get_emacs_var("eaf-video-player-auto-sync-write-back")),
+        ):
+            emacs_channel.message("Synchronizing subtitles to the audio.")
+        else:
+            emacs_channel.message("Subtitle synchronization already in progress.")
+
+    @interactive
+    def select_embedded_subtitle(self):
+        self.subtitles.embedded_select_pending = True
+        self.subtitles.embedded.list(self.subtitles.video_url)
+
+    @interactive
+    def toggle_metrics(self):
+        if metrics.enabled:
+            metrics.stop()
+            emacs_channel.message("Metrics disabled.", kind="metrics", owner=self)
+        else:
+            metrics.start(get_emacs_var("eaf-video-player-metrics-file"))
+            emacs_channel.message("Metrics enabled.", kind="metrics", owner=self)
+
+    @interactive
+    def show_metrics(self):
+        emacs_channel.call(
+            "eaf-video-player--show-metrics",
+            metrics.summary() + "\n\nMemory:\n" + buffer_governor.report(),
+        )
+
+    @interactive
+    def restart(self):
+        self.seek_scheduler.seek(0)
+
+
+# Start loading the next playlist item this many milliseconds before the current one ends.
+PLAYLIST_PRELOAD = 10000
+
+
+def list_video_files(directory):
+    extensions = tuple(
+        "." + extension for extension in get_emacs_var("eaf-video-extension-list")
+    )
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith(extensions) and not name.lower().endswith(".m3u")
+    ]
+
+
+def read_playlist(url):
+    """Return the videos to play if URL is a directory or a local .m3u list, else None.
+
+    Relative .m3u entries are relative to the list, http(s) entries are kept."""
+    if is_remote_url(url):
+        return None
+    if os.path.isdir(url):
+        return list_video_files(url)
+    if url.lower().endswith(".m3u"):
+        directory = os.path.dirname(url)
+        with open(url, "r", encoding="utf-8") as f:
+            entries = [line.strip() for line in f]
+        return [
+            (
+                entry
+                if is_remote_url(entry)
+                else os.path.join(directory, os.path.expanduser(entry))
+            )
+            for entry in entries
+            if entry and not entry.startswith("#")
+        ]
+    return None
+
+
+def preload_subtitles(video_path, languages):
+    """Parse the best subtitle of VIDEO_PATH into the shared timeline cache."""
+    try:
+        candidates = find_subtitle_files(video_path, languages)
+        if candidates:
+            load_cue_timeline(candidates[0])
+    except (OSError, ValueError):
+        pass
+
+
+class ControlPanel(QtWidgets.QGraphicsItem):
+    def __init__(self, parent=None):
+        super(ControlPanel, self).__init__(parent)
+        self.height = 0
+        self.width = 0
+        self.background_color = QColor(0, 0, 0, 255)
+        self.setOpacity(0.9)
+        # The panel only changes on resize, keep its pixels instead of repainting them.
+        self.setCacheMode(QtWidgets.QGraphicsItem.CacheMode.DeviceCoordinateCache)
+
+    def update_size(self, width, height):
+        if (width, height) == (self.width, self.height):
+            return
+        self.prepareGeometryChange()
+        self.width = width
+        self.height = height
+        self.update()
+
+    def paint(self, painter, option, widget):
+        painter.setPen(self.background_color)
+        painter.setBrush(self.background_color)
+        painter.drawRect(0, 0, self.width, self.height)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+
+class SeekScheduler(QtCore.QObject):
+    """Coalesce seeks on a QMediaPlayer.
+
+    At most one seek is in flight: it counts as done once the player reports
+    a position within `TOLERANCE' of its target, or after a timeout. Targets requested meanwhile replace
+    each other, so only the latest one reaches the decoder.
+
+    While scrubbing, seeks can be approximate: targets are snapped to
+    `approximate_step' and repeats of the same snapped target are dropped.
+    `finish_scrub' then issues one precise seek.
+    """
+
+    # How far from the target a position report may land and still be the
+    # seek's, rather than a playback tick from before it.
+    TOLERANCE = 500
+
+    def __init__(self, media_player, approximate_step=1000, timeout=250):
+        super(SeekScheduler, self).__init__()
+        self.media_player = media_player
+        self.approximate_step = approximate_step
+        self.in_flight = False
+        self.issued_position = None
+        self.target = None
+        self.pending = None
+        self.last_approximate = None
+        self.issued = 0
+        self.coalesced = 0
+        self.scrub_coalesced = 0
+
+        self.timeout_timer = QtCore.QTimer(self)
+        self.timeout_timer.setSingleShot(True)
+        self.timeout_timer.setInterval(timeout)
+        self.timeout_timer.timeout.connect(self.seek_timeout)
+
+        self.media_player.positionChanged.connect(self.position_changed)
+
+    def attach(self, media_player):
+        """Move to MEDIA_PLAYER, dropping seeks aimed at the previous one."""
+        self.media_player.positionChanged.disconnect(self.position_changed)
+        self.timeout_timer.stop()
+        metrics.discard("seek_latency", self)
+        self.in_flight = False
+        self.target = None
+        self.pending = None
+        self.media_player = media_player
+        self.media_player.positionChanged.connect(self.position_changed)
+
+    def position(self):
+        """The position playback will be at once requested seeks are applied."""
+        if self.target is not None:
+            return self.target
+        return self.media_player.position()
+
+    def seek(self, position, precise=True):
+        position = max(0, int(position))
+        duration = self.media_player.duration()
+        if duration > 0:
+            position = min(position, duration)
+
+        if not precise:
+            if self.last_approximate is None:
+                # A drag starts, earlier key repeats were not part of it.
+                self.scrub_coalesced = 0
+            position -= position % self.approximate_step
+            if position == self.last_approximate:
+                self.drop_seek(True)
+                return position
+            self.last_approximate = position
+
+        self.target = position
+        if self.in_flight:
+            if self.pending is not None:
+                self.drop_seek(not precise)
+            self.pending = position
+        else:
+            self.issue_seek(position)
+        return position
+
+    def finish_scrub(self, position):
+        """Seek precisely to POSITION and return how many seeks the scrub coalesced."""
+        self.last_approximate = None
+        self.seek(position)
+        coalesced = self.scrub_coalesced
+        self.scrub_coalesced = 0
+        return coalesced
+
+    def drop_seek(self, scrubbing):
+        self.coalesced += 1
+        if scrubbing:
+            self.scrub_coalesced += 1
+
+    def issue_seek(self, position):
+        self.in_flight = True
+        self.issued += 1
+        self.timeout_timer.start()
+        metrics.begin("seek_latency", self)
+        self.issued_position = position
+        self.media_player.setPosition(position)
+
+    def position_changed(self, position):
+        if self.in_flight and abs(position - self.issued_position) <= self.TOLERANCE:
+            metrics.end("seek_latency", self)
+            self.finish_seek()
+
+    def seek_timeout(self):
+        metrics.discard("seek_latency", self)
+        metrics.count("seek_timeout")
+        self.finish_seek()
+
+    def finish_seek(self):
+        self.timeout_timer.stop()
+        self.in_flight = False
+        if self.pending is not None:
+            position = self.pending
+            self.pending = None
+            self.issue_seek(position)
+        else:
+            self.target = None
+
+
+def file_cache_key(path):
+    """Cache key of the file at PATH, changes whenever the file is replaced or edited."""
+    stat = os.stat(path)
+    return hashlib.sha1(
+        f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8")
+    ).hexdigest()
+
+
+def cache_directory(name):
+    directory = os.path.join(get_emacs_config_dir(), "video-player", name)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class CueScheduler(QtCore.QObject):
+    """Update subtitles exactly at cue boundaries.
+
+    Instead of checking the timeline on every `positionChanged' tick, a
+    precise timer is armed for the next cue start or end, using the current
+    position and playback rate. It is re-armed on seek, pause, rate change
+    and when the timeline changes.
+
+    It also drives the loop modes: when `loop' is set to (start, end),
+    playback jumps back to start whenever it reaches end.
+
+    When `silence' holds a SilenceMap, silent spans are skipped: playback
+    jumps to the end of each span, or plays it at `silence_rate' if set.
+    """
+
+    # A position report this far from the extrapolated position is a seek.
+    SEEK_TOLERANCE = 300
+
+    def __init__(self, video_player):
+        super(CueScheduler, self).__init__()
+        self.video_player = video_player
+        self.media_player = video_player.media_player
+        self.subtitles = video_player.subtitles
+        self.loop = None
+        self.silence = None
+        self.silence_rate = None
+        self.normal_rate = None
+        self.skipped_span = None
+
+        self.anchor_position = 0
+        self.anchor_time = time.monotonic()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self.boundary_reached)
+
+        self.media_player.playbackStateChanged.connect(self.rearm)
+        self.media_player.playbackRateChanged.connect(self.rearm)
+        self.subtitles.timeline_changed.connect(self.rearm)
+
+    def attach(self, media_player):
+        self.media_player.playbackStateChanged.disconnect(self.rearm)
+        self.media_player.playbackRateChanged.disconnect(self.rearm)
+        self.media_player = media_player
+        self.media_player.playbackStateChanged.connect(self.rearm)
+        self.media_player.playbackRateChanged.connect(self.rearm)
+        self.rearm()
+
+    def is_playing(self):
+        return (
+            self.media_player.playbackState() == QMediaPlayer.PlaybackState.PlayingState
+        )
+
+    def estimated_position(self):
+        if not self.is_playing():
+            return self.anchor_position
+        elapsed = (time.monotonic() - self.anchor_time) * 1000
+        return int(self.anchor_position + elapsed * self.media_player.playbackRate())
+
+    def position_changed(self, position):
+        if abs(position - self.estimated_position()) > self.SEEK_TOLERANCE:
+            self.rearm(position=position)
+
+    def rearm(self, *args, position=None):
+        self.timer.stop()
+        if position is None:
+            position = self.media_player.position()
+        self.anchor_position = position
+        self.anchor_time = time.monotonic()
+
+        self.subtitles.update_subtitle(position)
+
+        if not self.is_playing():
+            return
+
+        boundaries = [self.subtitles.timeline.next_boundary(position)]
+        if self.loop is not None and position < self.loop[1]:
+            boundaries.append(self.loop[1])
+        if self.silence is not None:
+            boundary = self.skip_silence(position)
+            if boundary is False:
+                # Jumped or changed rate, the resulting signal rearms again.
+                return
+            boundaries.append(boundary)
+        boundaries = [boundary for boundary in boundaries if boundary is not None]
+        if boundaries:
+            rate = self.media_player.playbackRate() or 1.0
+            self.timer.start(max(0, ceil((min(boundaries) - position) / rate)))
+
+    def skip_silence(self, position):
+        """Handle a silent span at POSITION, return the next silence boundary.
+
+        Returns False when it seeked or changed the rate instead.
+        """
+        span = self.silence.span_at(position)
+        if span is None:
+            self.skipped_span = None
+            if self.normal_rate is not None:
+                rate, self.normal_rate = self.normal_rate, None
+                if self.change_rate(rate):
+                    return False
+            return self.silence.next_start(position)
+
+        end = self.silence.ends[span]
+        if not self.silence_rate:
+            # Do not keep seeking if the decoder lands short of the end.
+            if span != self.skipped_span:
+                self.skipped_span = span
+                self.video_player.seek_scheduler.seek(end)
+                return False
+        elif self.normal_rate is None:
+            self.normal_rate = self.media_player.playbackRate()
+            if self.change_rate(self.silence_rate):
+                return False
+        return end
+
+    def change_rate(self, rate):
+        """Set the playback rate, return whether it changed.
+
+        Only a change emits `playbackRateChanged', which rearms the timer.
+        """
+        if rate == self.media_player.playbackRate():
+            return False
+        self.media_player.setPlaybackRate(rate)
+        return True
+
+    def set_silence(self, silence, rate=None):
+        if silence is None and self.normal_rate is not None:
+            self.media_player.setPlaybackRate(self.normal_rate)
+        self.silence = silence
+        # nil in Emacs arrives as False, which means jumping like None.
+        self.silence_rate = float(rate) if rate else None
+        self.normal_rate = None
+        self.skipped_span = None
+        self.rearm()
+
+    def boundary_reached(self):
+        position = max(self.estimated_position(), self.media_player.position())
+        if self.loop is not None and position >= self.loop[1]:
+            self.video_player.seek_scheduler.seek(self.loop[0])
+            position = self.loop[0]
+        self.rearm(position=position)
+
+
+class FrameStepper(QtCore.QObject):
+    """Single-frame stepping served from a ring of recently decoded frames.
+
+    While stepping, every frame the video sink delivers is copied into a
+    ring bounded by MAX_FRAMES and MAX_BYTES, and the frame being shown is
+    drawn over the video by `frame_item'. A step onto a neighbouring frame
+    already in the ring needs no decoder work. A forward step past the
+    newest frame asks the paused decoder for the next one. A backward step
+    past the oldest frame pre-rolls: it seeks half a ring earlier and plays
+    muted up to the current frame, so the following backward steps are
+    served from the ring again.
+
+    Playing, or seeking elsewhere, ends stepping and frees the ring.
+    """
+
+    # Frame duration assumed when the frame does not carry an end time.
+    DEFAULT_FRAME_DURATION = 40000  # in microseconds
+
+    def __init__(self, video_player, max_frames, max_bytes):
+        super(FrameStepper, self).__init__()
+        self.video_player = video_player
+        self.media_player = video_player.media_player
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+
+        self.starts = []  # sorted frame start times, in microseconds
+        self.frames = {}  # start -> (end, QImage)
+        self.total_bytes = 0
+        self.last_frame = None
+        self.current = None
+        self.active = False
+        # "forward" while waiting for the decoder's next frame, or the start
+        # time a pre-roll plays up to.
+        self.waiting = None
+        self.was_muted = False
+
+        self.frame_item = None
+
+        video_player.video_item.videoSink().videoFrameChanged.connect(
+            self.frame_changed
+        )
+        self.media_player.playbackStateChanged.connect(self.playback_state_changed)
+        self.media_player.positionChanged.connect(self.position_changed)
+
+    def attach(self, media_player):
+        self.stop(sync=False)
+        self.media_player.playbackStateChanged.disconnect(self.playback_state_changed)
+        self.media_player.positionChanged.disconnect(self.position_changed)
+        self.media_player = media_player
+        self.media_player.playbackStateChanged.connect(self.playback_state_changed)
+        self.media_player.positionChanged.connect(self.position_changed)
+
+    def frame_changed(self, frame):
+        if not self.active:
+            # Only a shallow reference, so stepping can start from this frame.
+            self.last_frame = frame
+            return
+
+        start = self.add_frame(frame)
+        if start is None:
+            return
+
+        if self.waiting == "forward":
+            self.waiting = None
+            self.show(start)
+        elif self.waiting is not None and self.frames[start][0] > self.waiting:
+            target = self.waiting
+            self.waiting = None
+            self.media_player.pause()
+            self.video_player.audio_output.setMuted(self.was_muted)
+            self.show_neighbour(target, -1)
+
+    def add_frame(self, frame):
+        if frame is None or not frame.isValid() or frame.startTime() < 0:
+            return None
+
+        start = frame.startTime()
+        if start not in self.frames:
+            end = frame.endTime()
+            if end <= start:
+                end = start + self.DEFAULT_FRAME_DURATION
+            image = frame.toImage()
+            insort(self.starts, start)
+            self.frames[start] = (end, image)
+            self.total_bytes += image.sizeInBytes()
+            self.evict()
+        return start if start in self.frames else None
+
+    def evict(self):
+        # Drop the frames farthest from the one shown.
+        current = self.current if self.current is not None else self.starts[-1]
+        while len(self.starts) > 1 and (
+            len(self.starts) > self.max_frames or self.total_bytes > self.max_bytes
+        ):
+            if current - self.starts[0] >= self.starts[-1] - current:
+                start = self.starts.pop(0)
+            else:
+                start = self.starts.pop()
+            self.total_bytes -= self.frames.pop(start)[1].sizeInBytes()
+
+    def neighbour(self, start, direction):
+        """Return the frame right before or after START if the ring has it."""
+        index = bisect_left(self.starts, start) + direction
+        if not 0 <= index < len(self.starts):
+            return None
+        if direction > 0:
+            # No frame may have been skipped between the two.
+            contiguous = self.starts[index] <= self.frames[start][0] + 1000
+        else:
+            contiguous = self.frames[self.starts[index]][0] >= start - 1000
+        return self.starts[index] if contiguous else None
+
+    def step(self, direction):
+        if self.waiting is not None:
+            return
+
+        if not self.active:
+            self.active = True
+            self.media_player.pause()
+            self.current = self.add_frame(self.last_frame)
+            self.last_frame = None
+            if self.current is None:
+                # No decoded frame to start from, decode the one at the playhead.
+                self.waiting = "forward"
+                self.video_player.seek_scheduler.seek(self.media_player.position())
+                return
+
+        start = self.neighbour(self.current, direction)
+        if start is not None:
+            self.show(start)
+        elif direction > 0:
+            self.waiting = "forward"
+            self.video_player.seek_scheduler.seek(
+                ceil(self.frames[self.current][0] / 1000)
+            )
+        elif self.current <= 0:
+            emacs_channel.message(
+                "First frame.", kind="position", owner=self.video_player
+            )
+        else:
+            self.waiting = self.current
+            self.was_muted = self.video_player.audio_output.isMuted()
+            self.video_player.audio_output.setMuted(True)
+            frame_duration = self.frames[self.current][0] - self.current
+            preroll = frame_duration * max(1, self.max_frames // 2) // 1000
+            self.video_player.seek_scheduler.seek(
+                max(0, self.current // 1000 - preroll)
+            )
+            self.media_player.play()
+
+    def show_neighbour(self, start, direction):
+        neighbour = self.neighbour(start, direction)
+        if neighbour is not None:
+            self.show(neighbour)
+        elif start in self.frames:
+            self.show(start)
+
+    @timed("frame_step")
+    def show(self, start):
+        self.current = start
+        image = self.frames[start][1]
+        size = self.video_player.video_item.size().toSize()
+        pixmap = QPixmap.fromImage(
+            image.scaled(
+                size,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+        )
+        if self.frame_item is None:
+            self.frame_item = QtWidgets.QGraphicsPixmapItem()
+            # Above the video, below the control panel and subtitles.
+            self.frame_item.setZValue(-1)
+            self.video_player.scene.addItem(self.frame_item)
+        self.frame_item.setPixmap(pixmap)
+        self.frame_item.setPos(
+            (size.width() - pixmap.width()) / 2, (size.height() - pixmap.height()) / 2
+        )
+        self.frame_item.show()
+
+        position = start // 1000
+        if self.video_player.control_panel_visible:
+            self.video_player.progress_bar.update_progress(
+                self.media_player.duration(), position
+            )
+        self.video_player.subtitles.update_subtitle(position)
+        emacs_channel.message(
+            f"Frame at: {format_srt_time(position)}",
+            kind="position",
+            owner=self.video_player,
+        )
+
+    def playback_state_changed(self, state):
+        if (
+            self.active
+            and self.waiting is None
+            and state == QMediaPlayer.PlaybackState.PlayingState
+        ):
+            self.stop()
+
+    def position_changed(self, position):
+        # A seek away from the stepped frame, e.g. `play_forward', ends stepping.
+        if (
+            self.active
+            and self.waiting is None
+            and self.current is not None
+            and abs(position * 1000 - self.current)
+            > self.frames[self.current][0] - self.current + 1000
+        ):
+            self.stop(sync=False)
+
+    def stop(self, sync=True):
+        if not self.active:
+            return
+
+        if self.waiting is not None and self.waiting != "forward":
+            self.video_player.audio_output.setMuted(self.was_muted)
+        if sync and self.current is not None:
+            self.media_player.setPosition(self.current // 1000)
+        self.active = False
+        self.waiting = None
+        self.current = None
+        self.starts = []
+        self.frames = {}
+        self.total_bytes = 0
+        if self.frame_item is not None:
+            self.frame_item.hide()
+            self.frame_item.setPixmap(QPixmap())
+
+
+class ThumbnailSprite:
+    """Evenly spaced thumbnails of a video packed into one image.
+
+    `timestamps[i]' is the position, in milliseconds, of the tile at
+    row `i // columns' and column `i % columns'.
+    """
+
+    def __init__(self, path, image, timestamps, tile_width, tile_height, columns):
+        self.path = path
+        self.image = image
+        self.timestamps = timestamps
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns = columns
+
+    @classmethod
+    def load(cls, path, prefix):
+        try:
+            with open(prefix + ".json", "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        image = QImage(prefix + ".jpg")
+        if image.isNull():
+            return None
+
+        return cls(
+            path,
+            image,
+            array("q", index["timestamps"]),
+            index["tile_width"],
+            index["tile_height"],
+            index["columns"],
+        )
+
+    def save(self, prefix):
+        self.image.save(prefix + ".jpg", "JPG", 80)
+        with open(prefix + ".json", "w") as f:
+            json.dump(
+                {
+                    "timestamps": list(self.timestamps),
+                    "tile_width": self.tile_width,
+                    "tile_height": self.tile_height,
+                    "columns": self.columns,
+                },
+                f,
+            )
+
+    def thumbnail(self, position):
+        index = bisect_right(self.timestamps, position)
+        if index == len(self.timestamps) or (
+            index > 0
+            and position - self.timestamps[index - 1]
+            <= self.timestamps[index] - position
+        ):
+            index -= 1
+        index = max(index, 0)
+
+        row, column = divmod(index, self.columns)
+        return self.image.copy(
+            column * self.tile_width,
+            row * self.tile_height,
+            self.tile_width,
+            self.tile_height,
+        )
+
+
+class BackgroundJob:
+    """Cancellation state of one background job and the process it runs.
+
+    Each run gets its own, so cancelling or failing one job never touches
+    the event or process of the job that replaced it.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.process = None
+        self.lock = threading.Lock()
+
+    def popen(self, command, **kwargs):
+        """Start COMMAND unless the job is cancelled, return the process or None."""
+        with self.lock:
+            if self.cancelled.is_set():
+                return None
+            self.process = subprocess.Popen(command, **kwargs)
+            return self.process
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled.set()
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+
+
+class ThumbnailGenerator(QtCore.QObject):
+    """Build a ThumbnailSprite with ffmpeg in a background thread.
+
+    Each tile is one keyframe-seeked ffmpeg call, so generation never
+    decodes the whole file and can stop between tiles when cancelled.
+    Sprites are cached on disk, keyed by `file_cache_key'.
+    """
+
+    finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, count=100, tile_width=160, tile_height=90, columns=10):
+        super(ThumbnailGenerator, self).__init__()
+        self.count = count
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns = columns
+        self.job = BackgroundJob()
+
+    def start(self, path, duration):
+        self.cancel()
+
+        prefix = os.path.join(cache_directory("thumbnails"), file_cache_key(path))
+        sprite = ThumbnailSprite.load(path, prefix)
+        if sprite is not None:
+            self.finished.emit(sprite)
+            return
+
+        self.job = BackgroundJob()
+        threading.Thread(
+            target=self.run,
+            args=(path, duration, prefix, self.job),
+            daemon=True,
+        ).start()
+
+    def cancel(self):
+        self.job.cancel()
+
+    def run(self, path, duration, prefix, job):
+        rows = ceil(self.count / self.columns)
+        image = QImage(
+            self.columns * self.tile_width,
+            rows * self.tile_height,
+            QImage.Format.Format_RGB32,
+        )
+        image.fill(Qt.GlobalColor.black)
+        timestamps = array("q")
+
+        painter = QPainter(image)
+        for index in range(self.count):
+            if job.cancelled.is_set():
+                break
+
+            position = int(duration * (index + 0.5) / self.count)
+            frame = self.extract_frame(job, path, position)
+            if frame is None or frame.isNull():
+                continue
+
+            row, column = divmod(len(timestamps), self.columns)
+            painter.drawImage(column * self.tile_width, row * self.tile_height, frame)
+            timestamps.append(position)
+        painter.end()
+
+        if job.cancelled.is_set() or not timestamps:
+            return
+
+        sprite = ThumbnailSprite(
+            path, image, timestamps, self.tile_width, self.tile_height, self.columns
+        )
+        sprite.save(prefix)
+        self.finished.emit(sprite)
+
+    def extract_frame(self, job, path, position):
+        size = f"{self.tile_width}:{self.tile_height}"
+        command = [
+            "ffmpeg", "-v", "error", "-nostdin",
+            "-ss", f"{position / 1000:.3f}", "-i", path,
+            "-frames:v", "1",
+            "-vf", f"scale={size}:force_original_aspect_ratio=decrease,pad={size}:-1:-1",
+            "-f", "image2pipe", "-vcodec", "png", "-",
+        ]  # fmt: skip
+        try:
+            process = job.popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            if process is None:
+                return None
+            data, _ = process.communicate()
+        except OSError:
+            job.cancel()
+            return None
+        return QImage.fromData(data, "PNG")
+
+
+class ChapterIndex:
+    """Scene cuts found so far in a video, and how far the analysis got.
+
+    `times' are cut positions in milliseconds, `scores' how strong each
+    cut is, in thousandths. `histogram' is the float32 colour histogram of
+    the last frame analyzed, so a resumed analysis still finds a cut right
+    at `analyzed'. Stored on disk as an int64 header and arrays followed by
+    the histogram bytes.
+    """
+
+    def __init__(self, analyzed=0, done=False, times=None, scores=None, histogram=b""):
+        self.analyzed = analyzed
+        self.done = done
+        self.times = times if times is not None else array("q")
+        self.scores = scores if scores is not None else array("q")
+        self.histogram = histogram
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return cls()
+        if len(data) < 24:
+            return cls()
+        analyzed, done, count = struct.unpack_from("<3q", data)
+        end = 24 + count * 16
+        if count < 0 or len(data) < end:
+            return cls()
+        values = array("q", data[24:end])
+        return cls(analyzed, bool(done), values[:count], values[count:], data[end:])
+
+    def save(self, path):
+        header = struct.pack("<3q", self.analyzed, int(self.done), len(self.times))
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(header + self.times.tobytes() + self.scores.tobytes())
+            f.write(self.histogram)
+        os.replace(temp_path, path)
+
+    def copy(self):
+        return ChapterIndex(
+            self.analyzed,
+            self.done,
+            array("q", self.times),
+            array("q", self.scores),
+            self.histogram,
+        )
+
+    def chapters(self, min_length):
+        """Pick the strongest cuts at least MIN_LENGTH milliseconds apart, in order."""
+        chosen = []
+        for score, time_ in sorted(zip(self.scores, self.times), reverse=True):
+            index = bisect_left(chosen, time_)
+            if (index == 0 or time_ - chosen[index - 1] >= min_length) and (
+                index == len(chosen) or chosen[index] - time_ >= min_length
+            ):
+                chosen.insert(index, time_)
+        return chosen
+
+
+# One chapter analysis at a time, however many buffers are open.
+chapter_analysis_lock = threading.Lock()
+
+
+class ChapterAnalyzer(QtCore.QObject):
+    """Find the scene cuts of a video in the background, one segment at a time.
+
+    Frames are sampled at FPS and scaled to WIDTH x HEIGHT by a niced
+    ffmpeg of its own, so analysis never shares the player's decoder. A
+    cut is where the colour histograms of consecutive frames differ by
+    more than THRESHOLD. The ChapterIndex is saved after every segment,
+    keyed by `file_cache_key', so a later run resumes where this one
+    stopped. Needs numpy, without it no chapters are found.
+    """
+
+    FPS = 2
+    WIDTH = 64
+    HEIGHT = 36
+    SEGMENT = 300000  # in milliseconds
+    THRESHOLD = 0.4
+
+    progress = QtCore.pyqtSignal(str, object)
+
+    def __init__(self):
+        super(ChapterAnalyzer, self).__init__()
+        self.job = BackgroundJob()
+
+    def start(self, path, duration):
+        self.cancel()
+        self.job = BackgroundJob()
+        threading.Thread(
+            target=self.run, args=(path, duration, self.job), daemon=True
+        ).start()
+
+    def cancel(self):
+        self.job.cancel()
+
+    def run(self, path, duration, job):
+        cancelled = job.cancelled
+        try:
+            import numpy
+        except ImportError:
+            return
+
+        index_path = os.path.join(
+            cache_directory("chapters"), file_cache_key(path) + ".chapters"
+        )
+        index = ChapterIndex.load(index_path)
+        if index.times:
+            self.progress.emit(path, index.copy())
+
+        previous = None
+        if index.histogram:
+            previous = numpy.frombuffer(index.histogram, dtype=numpy.float32)
+        while not index.done and not cancelled.is_set():
+            with chapter_analysis_lock:
+                if cancelled.is_set():
+                    return
+                try:
+                    result = self.analyze_segment(job, path, index.analyzed, previous)
+                except (OSError, ValueError):
+                    return
+            if result is None or cancelled.is_set():
+                return
+
+            times, scores, previous = result
+            index.times.extend(times)
+            index.scores.extend(scores)
+            index.analyzed += self.SEGMENT
+            index.done = previous is None or index.analyzed >= duration
+            index.histogram = b"" if previous is None else previous.tobytes()
+            try:
+                index.save(index_path)
+            except OSError:
+                pass
+            # The GUI thread reads its own copy while this one keeps growing.
+            self.progress.emit(path, index.copy())
+
+    def analyze_segment(self, job, path, start, previous):
+        """Return the cuts in the SEGMENT from START, and the last frame's histogram.
+
+        PREVIOUS is the last histogram of the segment before, so a cut right
+        at the boundary is found too. The histogram is None past the end.
+        """
+        import numpy
+
+        # fmt: off
+        command = [
+            "ffmpeg", "-v", "error", "-nostdin",
+            "-ss", f"{start / 1000:.3f}", "-t", f"{self.SEGMENT / 1000:.3f}",
+            "-i", path, "-an", "-sn",
+            "-vf", f"fps={self.FPS},scale={self.WIDTH}:{self.HEIGHT}",
+            "-pix_fmt", "rgb24", "-f", "rawvideo", "-",
+        ]
+        # fmt: on
+        process = job.popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            preexec_fn=(lambda: os.nice(10)) if hasattr(os, "nice") else None,
+        )
+        if process is None:
+            return None
+        data, _ = process.communicate()
+        if process.returncode != 0:
+            return None
+
+        pixels = self.WIDTH * self.HEIGHT
+        frames = numpy.frombuffer(data, dtype=numpy.uint8)
+        frames = frames[: len(frames) // (pixels * 3) * pixels * 3].reshape(
+            -1, pixels, 3
+        )
+        if not len(frames):
+            return array("q"), array("q"), None
+
+        # 8 levels per channel, 512 bins per frame, all frames in one bincount.
+        bins = (
+            (frames[..., 0] >> 5).astype(numpy.int32) << 6
+            | (frames[..., 1] >> 5).astype(numpy.int32) << 3
+            | (frames[..., 2] >> 5)
+        )
+        bins += numpy.arange(len(frames), dtype=numpy.int32)[:, None] * 512
+        histograms = numpy.bincount(bins.ravel(), minlength=len(frames) * 512)
+        histograms = histograms.reshape(-1, 512).astype(numpy.float32) / pixels
+
+        first = 0
+        if previous is not None:
+            histograms = numpy.vstack((previous, histograms))
+            first = 1
+        differences = numpy.abs(numpy.diff(histograms, axis=0)).sum(axis=1) / 2
+        cuts = numpy.flatnonzero(differences > self.THRESHOLD)
+
+        times = start + (cuts + 1 - first) * 1000 // self.FPS
+        scores = numpy.rint(differences[cuts] * 1000)
+        return (
+            array("q", times.astype(numpy.int64).tobytes()),
+            array("q", scores.astype(numpy.int64).tobytes()),
+            histograms[-1],
+        )
+
+
+class ProgressBar(QWidget):
+    progress_changed = QtCore.pyqtSignal(float)
+    progress_released = QtCore.pyqtSignal(float)
+    hover_changed = QtCore.pyqtSignal(float)
+
+    def __init__(self, theme_background_color, theme_foreground_color):
+        super(QWidget, self).__init__()
+        self.foreground_color = QColor(theme_foreground_color)
+        self.background_color = QColor(theme_background_color)
+        self.position = 0
+        self.duration = 0
+        self.is_press = False
+        self.render_height = 10
+        self.ticks = []
+        self.tick_color = QColor(self.foreground_color)
+        self.tick_color.setAlpha(160)
+        self.setMouseTracking(True)
+
+        # Only the span between the painted and the current progress is
+        # repainted, at most `max_fps' times per second.
+        self.max_fps = 30
+        self.painted_width = None
+        self.last_repaint = 0.0
+        self.repaint_timer = QtCore.QTimer(self)
+        self.repaint_timer.setSingleShot(True)
+        self.repaint_timer.timeout.connect(self.repaint_progress)
+
+    def progress_width(self):
+        if self.duration <= 0:
+            return 0
+        return int(self.width() * self.position / self.duration)
+
+    def update_progress(self, duration, position):
         self.position = position
-        self.duration = duration
+        if duration != self.duration:
+            self.duration = duration
+            self.painted_width = None
+
+        if self.progress_width() == self.painted_width or self.repaint_timer.isActive():
+            return
+
+        delay = self.last_repaint + 1 / self.max_fps - time.monotonic()
+        if delay > 0:
+            self.repaint_timer.start(ceil(delay * 1000))
+        else:
+            self.repaint_progress()
+
+    def repaint_progress(self):
+        self.last_repaint = time.monotonic()
+        width = self.progress_width()
+        if self.painted_width is None:
+            self.update()
+        elif width != self.painted_width:
+            self.update(
+                min(width, self.painted_width),
+                int((self.height() - self.render_height) / 2),
+                abs(width - self.painted_width) + 1,
+                self.render_height,
+            )
+
+    def set_ticks(self, ticks):
+        """Mark TICKS, positions in milliseconds, on the bar."""
+        self.ticks = ticks
+        self.painted_width = None
         self.update()
 
-    def mousePressEvent(self, event):
-        self.is_press = True
-        self.progress_changed.emit(event.position().x() * 1.0 / self.width())
+    def resizeEvent(self, event):
+        self.painted_width = None
+        super().resizeEvent(event)
+
+    def event_percent(self, event):
+        return min(max(event.position().x() * 1.0 / self.width(), 0.0), 1.0)
+
+    def mousePressEvent(self, event):
+        # A click only seeks on release, once and precisely; dragging seeks
+        # approximately on the way.
+        self.is_press = True
+
+    def mouseReleaseEvent(self, event):
+        if self.is_press:
+            self.progress_released.emit(self.event_percent(event))
+        self.is_press = False
+
+    def mouseMoveEvent(self, event):
+        if self.is_press:
+            self.progress_changed.emit(self.event_percent(event))
+        self.hover_changed.emit(self.event_percent(event))
+
+    def leaveEvent(self, event):
+        self.hover_changed.emit(-1.0)
+
+    @timed("progress_bar_paint")
+    def paintEvent(self, event):
+        painter = QPainter(self)
+
+        render_y = (self.height() - self.render_height) / 2
+
+        painter.setPen(self.background_color)
+        painter.setBrush(self.background_color)
+        painter.drawRect(0, int(render_y), int(self.width()), int(self.render_height))
+
+        if self.duration > 0:
+            painter.setPen(self.foreground_color)
+            painter.setBrush(self.foreground_color)
+            painter.drawRect(
+                0,
+                int(render_y),
+                self.progress_width(),
+                int(self.render_height),
+            )
+
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.tick_color)
+            for tick in self.ticks:
+                x = int(self.width() * tick / self.duration)
+                painter.drawRect(x, int(render_y) - 3, 2, int(self.render_height) + 6)
+        self.painted_width = self.progress_width()
+
+
+def format_srt_time(milliseconds):
+    """Format MILLISECONDS the way SubRip writes timestamps, e.g. 00:01:02,345."""
+    seconds, milliseconds = divmod(int(milliseconds), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
+
+
+def clean_cue_text(text):
+    """Strip markup tags from cue TEXT and collapse it to single-space separated words."""
+    return " ".join(re.sub(r"<[^>]+>", "", text).split())
+
+
+class CueTimeline:
+    """Array-backed subtitle timeline, sorted by cue start.
+
+    Lookup keeps a cursor on the last cue that started before the queried
+    position, so the common case during playback (position moves forward a
+    little) is O(1). Any jump, such as a seek, falls back to bisect.
+    """
+
+    def __init__(self, starts=(), ends=(), texts=()):
+        order = sorted(range(len(starts)), key=lambda i: (starts[i], ends[i]))
+        self.starts = array("q", (starts[i] for i in order))
+        self.ends = array("q", (ends[i] for i in order))
+        self.texts = [texts[i] for i in order]
+
+        # Running maximum of the end times, so lookup knows when no earlier
+        # cue can still be active and stops walking back over overlaps.
+        self.max_ends = array("q")
+        running_end = -1
+        for end in self.ends:
+            running_end = max(running_end, end)
+            self.max_ends.append(running_end)
+
+        self.cursor = -1
+
+    @classmethod
+    def from_arrays(cls, starts, ends, max_ends, texts):
+        """Wrap already sorted arrays, e.g. from the sidecar cache, without copying."""
+        timeline = cls.__new__(cls)
+        timeline.starts = starts
+        timeline.ends = ends
+        timeline.max_ends = max_ends
+        timeline.texts = texts
+        timeline.cursor = -1
+        return timeline
+
+    @classmethod
+    def from_srt(cls, subs):
+        return cls(
+            [sub.start.ordinal for sub in subs],
+            [sub.end.ordinal for sub in subs],
+            [clean_cue_text(sub.text) for sub in subs],
+        )
+
+    def copy(self):
+        """Share the cue data but keep a separate lookup cursor."""
+        return CueTimeline.from_arrays(
+            self.starts, self.ends, self.max_ends, self.texts
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def size_in_bytes(self):
+        """Bytes held on the heap, texts mapped from the sidecar cache are not counted."""
+        size = sum(
+            values.itemsize * len(values)
+            for values in (self.starts, self.ends, self.max_ends)
+            if isinstance(values, array)
+        )
+        if isinstance(self.texts, list):
+            size += sum(sys.getsizeof(text) for text in self.texts)
+        return size
+
+    def seek_index(self, position):
+        """Return the index of the last cue starting at or before POSITION, or -1."""
+        starts = self.starts
+        count = len(starts)
+        cursor = self.cursor
+
+        if cursor < count:
+            if (cursor < 0 or starts[cursor] <= position) and (
+                cursor + 1 == count or starts[cursor + 1] > position
+            ):
+                return cursor
+
+            following = cursor + 1
+            if (
+                following < count
+                and starts[following] <= position
+                and (following + 1 == count or starts[following + 1] > position)
+            ):
+                self.cursor = following
+                return following
+
+        self.cursor = bisect_right(starts, position) - 1
+        return self.cursor
+
+    def active(self, position):
+        """Return the indexes of all cues shown at POSITION, in start order."""
+        index = self.seek_index(position)
+        indexes = []
+        while index >= 0 and self.max_ends[index] >= position:
+            if self.ends[index] >= position:
+                indexes.append(index)
+            index -= 1
+        indexes.reverse()
+        return tuple(indexes)
+
+    def next_index(self, position):
+        """Return the index of the first cue starting after POSITION, or None."""
+        index = bisect_right(self.starts, position)
+        return index if index < len(self.starts) else None
+
+    def previous_index(self, position):
+        """Return the index of the cue before the one at POSITION, or None."""
+        if not self.starts:
+            return None
+        return max(0, bisect_right(self.starts, position) - 2)
+
+    def next_boundary(self, position):
+        """Return the first position after POSITION where the shown cues change, or None."""
+        boundaries = [self.ends[index] + 1 for index in self.active(position)]
+        index = bisect_right(self.starts, position)
+        if index < len(self.starts):
+            boundaries.append(self.starts[index])
+        return min(boundaries, default=None)
+
+
+class CueIndex:
+    """Inverted index from case-folded, tag-stripped words to the cues containing them."""
+
+    TOKEN = re.compile(r"\w+")
+    TAG = re.compile(r"<[^>]+>|\{[^}]*\}")
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        postings = {}
+        for index in range(len(timeline)):
+            for token in set(self.tokenize(timeline.texts[index])):
+                cues = postings.get(token)
+                if cues is None:
+                    cues = postings[token] = array("I")
+                cues.append(index)
+        self.postings = postings
+        self.tokens = sorted(postings)
+
+    @classmethod
+    def tokenize(cls, text):
+        return cls.TOKEN.findall(cls.TAG.sub(" ", text).casefold())
+
+    def prefixed(self, prefix):
+        index = bisect_left(self.tokens, prefix)
+        while index < len(self.tokens) and self.tokens[index].startswith(prefix):
+            yield self.tokens[index]
+            index += 1
+
+    def search(self, query, limit=500):
+        """Return the indices of the cues matching QUERY, best first.
+
+        Cues containing more of the query words rank first, rarer words
+        weigh more, ties keep timeline order. The last word also matches
+        as a prefix, so results show up while it is still being typed.
+        """
+        words = self.tokenize(query)[:8]
+        if not words:
+            return list(range(min(len(self.timeline), limit)))
+
+        total = len(self.timeline)
+        # Split the matching cues into groups by which query words they
+        # contain, with set operations only, then rank the groups.
+        groups = None
+        for position, word in enumerate(words):
+            if position == len(words) - 1:
+                tokens = self.prefixed(word)
+            else:
+                tokens = [word] if word in self.postings else []
+            cues = set()
+            for token in tokens:
+                cues.update(self.postings[token])
+            if not cues:
+                continue
+
+            weight = 1 + (total // len(cues)).bit_length()
+            if groups is None:
+                groups = [(1, weight, cues)]
+                continue
+            split_groups = []
+            for matched, score, group in groups:
+                split_groups.append((matched + 1, score + weight, group & cues))
+                split_groups.append((matched, score, group - cues))
+                cues = cues - group
+            split_groups.append((1, weight, cues))
+            groups = [group for group in split_groups if group[2]]
+
+        # Groups with different words can rank the same, merge them so their
+        # cues come out in timeline order.
+        ranked = {}
+        for matched, score, group in groups or ():
+            ranked.setdefault((matched, score), set()).update(group)
+
+        results = []
+        for key in sorted(ranked, reverse=True):
+            results.extend(sorted(ranked[key]))
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+
+class PackedTexts:
+    """Read-only sequence of cue texts stored back to back in one UTF-8 blob."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.blob[self.offsets[index] : self.offsets[index + 1]], "utf-8")
+
+
+CUE_CACHE_MAGIC = b"EVPCUES" + (b"<" if sys.byteorder == "little" else b">")
+CUE_CACHE_HEADER = struct.Struct("=8sQ")
+
+SUBTITLE_EXTENSIONS = (".srt", ".vtt", ".ass", ".ssa")
+
+
+def parse_timestamp(timestamp):
+    """Parse a VTT or ASS timestamp, e.g. 01:02:03.450 or 1:02:03.45, to milliseconds."""
+    seconds = 0.0
+    for part in timestamp.strip().replace(",", ".").split(":"):
+        seconds = seconds * 60 + float(part)
+    return int(round(seconds * 1000))
+
+
+def parse_vtt(text):
+    starts, ends, texts = [], [], []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n")):
+        lines = block.strip().split("\n")
+        for index, line in enumerate(lines):
+            if "-->" in line:
+                start, end = line.split("-->")
+                starts.append(parse_timestamp(start))
+                ends.append(parse_timestamp(end.split()[0]))
+                texts.append(clean_cue_text(" ".join(lines[index + 1 :])))
+                break
+    return CueTimeline(starts, ends, texts)
+
+
+def parse_ass(text):
+    starts, ends, texts = [], [], []
+    fields = ["layer", "start", "end", "style", "name", "marginl", "marginr", "marginv", "effect", "text"]  # fmt: skip
+    in_events = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("["):
+            in_events = line.lower() == "[events]"
+        elif in_events and line.lower().startswith("format:"):
+            fields = [field.strip().lower() for field in line[7:].split(",")]
+        elif in_events and line.lower().startswith("dialogue:"):
+            values = line[9:].split(",", len(fields) - 1)
+            event = dict(zip(fields, values))
+            dialogue = re.sub(r"{[^}]*}", "", event.get("text", ""))
+            dialogue = re.sub(r"\\[Nnh]", " ", dialogue)
+            starts.append(parse_timestamp(event["start"]))
+            ends.append(parse_timestamp(event["end"]))
+            texts.append(clean_cue_text(dialogue))
+    return CueTimeline(starts, ends, texts)
+
+
+def parse_subtitle_file(subtitle_path):
+    extension = os.path.splitext(subtitle_path)[1].lower()
+    with open(subtitle_path, "r", encoding="utf-8-sig", errors="replace") as f:
+        text = f.read()
+    if extension == ".srt":
+        import pysrt
+
+        return CueTimeline.from_srt(pysrt.from_string(text))
+    if extension == ".vtt":
+        return parse_vtt(text)
+    return parse_ass(text)
+
+
+# Subtitle file names per directory, with the directory mtime they were listed at.
+subtitle_directories = {}
+
+
+def list_subtitle_files(directory):
+    """List subtitle files in DIRECTORY, rescanning only when the directory changed."""
+    mtime = os.stat(directory).st_mtime_ns
+    cached = subtitle_directories.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with os.scandir(directory) as entries:
+        names = sorted(
+            entry.name
+            for entry in entries
+            if entry.name.lower().endswith(SUBTITLE_EXTENSIONS)
+        )
+    subtitle_directories[directory] = (mtime, names)
+    return names
+
+
+def find_subtitle_files(video_path, languages=()):
+    """Return the subtitle files that belong to VIDEO_PATH, best match first.
+
+    An exact name match (video.srt) comes first, then files tagged with one
+    of LANGUAGES in preference order (video.en.srt), then other tags, then
+    files whose name merely starts with the video name.
+    """
+    directory = os.path.dirname(video_path) or "."
+    base = os.path.splitext(os.path.basename(video_path))[0]
+    languages = [language.lower() for language in languages]
+
+    ranked = []
+    for name in list_subtitle_files(directory):
+        stem, extension = os.path.splitext(name)
+        if stem == base:
+            rank = 0
+        elif stem.startswith(base) and stem[len(base)] in "._- ":
+            tags = re.split(r"[._\- ]+", stem[len(base) + 1 :].lower())
+            rank = 1 + min(
+                (languages.index(tag) for tag in tags if tag in languages),
+                default=len(languages),
+            )
+        elif stem.lower().startswith(base.lower()):
+            rank = 2 + len(languages)
+        else:
+            continue
+        ranked.append((rank, SUBTITLE_EXTENSIONS.index(extension.lower()), name))
+
+    return [os.path.join(directory, name) for _, _, name in sorted(ranked)]
+
+
+# Timelines already loaded in this process, shared by every buffer, least
+# recently used first. Holds at most LOADED_TIMELINES_MAX, and only the
+# latest version of each file.
+loaded_timelines = OrderedDict()
+loaded_timelines_lock = threading.Lock()
+LOADED_TIMELINES_MAX = 16
+
+
+def write_cue_cache(path, timeline):
+    """Write TIMELINE to PATH as a header, the start, end and max end arrays,
+    the text offsets and finally the UTF-8 text blob."""
+    blob = bytearray()
+    offsets = array("Q", [0])
+    for text in timeline.texts:
+        blob += text.encode("utf-8")
+        offsets.append(len(blob))
+
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(CUE_CACHE_HEADER.pack(CUE_CACHE_MAGIC, len(timeline)))
+        for values in (timeline.starts, timeline.ends, timeline.max_ends, offsets):
+            f.write(array(values.typecode, values).tobytes())
+        f.write(blob)
+    os.replace(temp_path, path)
+
+
+def read_cue_cache(path):
+    """Map the cache file at PATH and return a CueTimeline reading straight from it."""
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(data) < CUE_CACHE_HEADER.size:
+        return None
+    magic, count = CUE_CACHE_HEADER.unpack_from(data)
+    if magic != CUE_CACHE_MAGIC or len(data) < CUE_CACHE_HEADER.size + count * 32 + 8:
+        return None
+
+    view = memoryview(data)
+    offset = CUE_CACHE_HEADER.size
+    arrays = []
+    for typecode, length in [("q", count)] * 3 + [("Q", count + 1)]:
+        arrays.append(view[offset : offset + length * 8].cast(typecode))
+        offset += length * 8
+    starts, ends, max_ends, offsets = arrays
+
+    return CueTimeline.from_arrays(
+        starts, ends, max_ends, PackedTexts(view[offset:], offsets)
+    )
+
+
+def load_cue_timeline(subtitle_path):
+    """Parse SUBTITLE_PATH, going through the process-wide and on-disk caches."""
+    stat = os.stat(subtitle_path)
+    key = (os.path.abspath(subtitle_path), stat.st_size, stat.st_mtime_ns)
+
+    with loaded_timelines_lock:
+        timeline = loaded_timelines.get(key)
+        if timeline is not None:
+            loaded_timelines.move_to_end(key)
+    if timeline is None:
+        cache_path = os.path.join(
+            cache_directory("subtitles"), file_cache_key(subtitle_path) + ".cues"
+        )
+        timeline = read_cue_cache(cache_path)
+        if timeline is None:
+            timeline = parse_subtitle_file(subtitle_path)
+            try:
+                write_cue_cache(cache_path, timeline)
+            except OSError:
+                pass
+        with loaded_timelines_lock:
+            # Older versions of the file are never looked up again.
+            for stale in [stale for stale in loaded_timelines if stale[0] == key[0]]:
+                del loaded_timelines[stale]
+            loaded_timelines[key] = timeline
+            while len(loaded_timelines) > LOADED_TIMELINES_MAX:
+                loaded_timelines.popitem(last=False)
+
+    return timeline.copy()
+
+
+def video_hash(path):
+    """OpenSubtitles hash of the video at PATH: its size plus the 64-bit sums
+    of its first and last 64 KiB. Cheap to compute even over the network."""
+    chunk_size = 64 * 1024
+    size = os.path.getsize(path)
+    value = size
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size - chunk_size)):
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            chunk = chunk[: len(chunk) - len(chunk) % 8]
+            for (word,) in struct.iter_unpack("<Q", chunk):
+                value = (value + word) & 0xFFFFFFFFFFFFFFFF
+    return f"{value:016x}"
+
+
+class SubliminalProvider:
+    """Subtitle provider backed by subliminal, used unless another one is plugged in.
+
+    A provider only needs `download(video_path, languages)', returning a
+    list of (language, subtitle text) pairs in SubRip format, each language
+    spelled as it was in LANGUAGES, since downloads are cached under it.
+    """
+
+    def __init__(self):
+        self.configured = False
+
+    def download(self, video_path, languages):
+        from babelfish import Language
+        from subliminal import download_best_subtitles, region, scan_video
+
+        if not self.configured:
+            region.configure(
+                "dogpile.cache.dbm",
+                arguments={
+                    "filename": os.path.join(
+                        cache_directory("downloads"), "subliminal.dbm"
+                    )
+                },
+                replace_existing_backend=True,
+            )
+            self.configured = True
+
+        requested = {Language.fromietf(language): language for language in languages}
+        video = scan_video(video_path)
+        subtitles = download_best_subtitles([video], set(requested))
+        # Language("eng") prints as "en", answer with the tag that was asked for.
+        return [
+            (requested.get(subtitle.language, str(subtitle.language)), subtitle.text)
+            for subtitle in subtitles[video]
+            if subtitle.text
+        ]
+
+
+class SubtitleDownloader:
+    """Long-lived subtitle download worker shared by every buffer.
+
+    Requests for a video that is already queued are merged, so mashing the
+    key or batch downloading a directory never downloads a video twice.
+    Downloads are cached under the EAF config dir by `video_hash', the
+    same video is never fetched again even if it was renamed or moved.
+    """
+
+    def __init__(self, provider=None):
+        self.provider = provider
+        self.queue = queue.Queue()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def download(self, video_path, languages, callback):
+        """Queue VIDEO_PATH, CALLBACK gets (video_path, subtitle_paths, error).
+
+        Return False if the video was already queued."""
+        with self.lock:
+            if video_path in self.in_flight:
+                self.in_flight[video_path].append(callback)
+                return False
+            self.in_flight[video_path] = [callback]
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+        self.queue.put((video_path, list(languages)))
+        return True
+
+    def run(self):
+        while True:
+            video_path, languages = self.queue.get()
+            try:
+                subtitle_paths, error = self.fetch(video_path, languages), None
+            except Exception as e:
+                subtitle_paths, error = [], e
+
+            with self.lock:
+                callbacks = self.in_flight.pop(video_path, [])
+            for callback in callbacks:
+                callback(video_path, subtitle_paths, error)
+
+    def fetch(self, video_path, languages):
+        cache_dir = cache_directory("downloads")
+        key = video_hash(video_path)
+
+        def cache_path(language):
+            return os.path.join(cache_dir, f"{key}.{language}.srt")
+
+        missing = [
+            language
+            for language in languages
+            if not os.path.exists(cache_path(language))
+        ]
+        if missing:
+            if self.provider is None:
+                self.provider = SubliminalProvider()
+            for language, text in self.provider.download(video_path, missing):
+                with open(cache_path(language), "w", encoding="utf-8") as f:
+                    f.write(text)
+
+        # Copy next to the video, where subtitle discovery looks for it.
+        base = os.path.splitext(video_path)[0]
+        subtitle_paths = []
+        for language in languages:
+            if not os.path.exists(cache_path(language)):
+                continue
+            subtitle_path = f"{base}.{language}.srt"
+            try:
+                if not os.path.exists(subtitle_path):
+                    shutil.copyfile(cache_path(language), subtitle_path)
+            except OSError:
+                subtitle_path = cache_path(language)
+            subtitle_paths.append(subtitle_path)
+        return subtitle_paths
+
+
+subtitle_downloader = SubtitleDownloader()
+
+
+def is_remote_url(url):
+    return url is not None and url.startswith(("http://", "https://"))
+
+
+class SegmentCache:
+    """On-disk cache of remote files, kept as fixed size chunks fetched with range requests.
+
+    Chunks are evicted least recently used first once the cache grows past
+    `max_bytes'. Every chunk is fetched at most once at a time, readers of a
+    chunk being fetched wait for it.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.fetching = {}
+
+        # Chunk path -> size, least recently used first.
+        self.chunks = OrderedDict()
+        self.total_bytes = 0
+        entries = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith(".chunk"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append(
+                        (stat.st_mtime, os.path.join(root, name), stat.st_size)
+                    )
+        for _, path, size in sorted(entries):
+            self.chunks[path] = size
+            self.total_bytes += size
+
+    def resource_directory(self, url):
+        return os.path.join(
+            self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest()
+        )
+
+    def chunk_path(self, url, index):
+        return os.path.join(self.resource_directory(url), f"{index}.chunk")
+
+    def is_cached(self, url, index):
+        with self.lock:
+            return self.chunk_path(url, index) in self.chunks
+
+    def size(self, url):
+        """Size of the remote file at URL, from a range request for its first byte."""
+        size = self.sizes.get(url)
+        if size is None:
+            import urllib.request
+
+            request = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                content_range = response.headers.get("Content-Range")
+                if content_range is not None:
+                    size = int(content_range.rsplit("/", 1)[1])
+                else:
+                    size = int(response.headers["Content-Length"])
+            self.sizes[url] = size
+        return size
+
+    def chunk(self, url, index):
+        path = self.chunk_path(url, index)
+        while True:
+            with self.lock:
+                if path in self.chunks:
+                    self.chunks.move_to_end(path)
+                    break
+                event = self.fetching.get(path)
+                if event is None:
+                    event = self.fetching[path] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+
+            if not owner:
+                event.wait()
+                continue
+
+            try:
+                data = self.fetch(url, index)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+                with self.lock:
+                    self.chunks[path] = len(data)
+                    self.total_bytes += len(data)
+                    self.evict()
+                return data
+            finally:
+                with self.lock:
+                    del self.fetching[path]
+                event.set()
+
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted between the check and the read.
+            with self.lock:
+                self.total_bytes -= self.chunks.pop(path, 0)
+            return self.chunk(url, index)
+
+    def fetch(self, url, index):
+        import urllib.request
+
+        start = index * self.CHUNK_SIZE
+        end = min(start + self.CHUNK_SIZE, self.size(url)) - 1
+        request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            if response.status == 206:
+                return response.read()
+            # The server ignored the range, skip to the chunk a piece at a time.
+            remaining = start
+            while remaining > 0:
+                skipped = len(response.read(min(remaining, self.CHUNK_SIZE)))
+                if not skipped:
+                    raise ValueError(f"{url} ended before byte {start}")
+                remaining -= skipped
+            return response.read(end - start + 1)
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.chunks) > 1:
+            path, size = self.chunks.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class MediaCacheHandler:
+    """Serve /<base64 url> from the segment cache, honouring Range requests.
+
+    Mixed into `http.server.BaseHTTPRequestHandler' by `MediaCacheProxy', so
+    http.server is only imported once a remote video is opened.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.serve(False)
+
+    def do_GET(self):
+        self.serve(True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def serve(self, send_body):
+        import urllib.parse
+
+        proxy = self.server.proxy
+        try:
+            url = base64.urlsafe_b64decode(self.path.split("/")[1]).decode("utf-8")
+        except (IndexError, ValueError):
+            self.send_error(404)
+            return
+        # Only what the player was given, never an arbitrary URL or file.
+        if not proxy.is_registered(url):
+            self.send_error(404)
+            return
+
+        try:
+            if urllib.parse.urlparse(url).path.endswith((".m3u8", ".m3u")):
+                self.send_data(
+                    proxy.playlist(url), "application/vnd.apple.mpegurl", send_body
+                )
+            else:
+                self.send_range(proxy, url, send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The player drops connections when it seeks.
+            pass
+        except (OSError, ValueError) as e:
+            self.send_error(502, str(e))
+
+    def send_data(self, data, content_type, send_body):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def send_range(self, proxy, url, send_body):
+        import mimetypes
+        import urllib.parse
+
+        cache = proxy.cache
+        size = cache.size(url)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(0, size - int(match.group(2)))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        content_type = mimetypes.guess_type(urllib.parse.urlparse(url).path)[0]
+        self.send_header("Content-Type", content_type or "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(max(0, end - start + 1)))
+        self.end_headers()
+        if not send_body:
+            return
+
+        chunk_size = SegmentCache.CHUNK_SIZE
+        for index in range(start // chunk_size, end // chunk_size + 1):
+            proxy.read_ahead(url, index)
+            data = cache.chunk(url, index)
+            offset = index * chunk_size
+            self.wfile.write(data[max(start - offset, 0) : end - offset + 1])
+
+
+class MediaCacheProxy:
+    """Local HTTP server that puts a read-ahead SegmentCache in front of remote media.
+
+    The player opens `proxy_url(url)' instead of URL. Byte ranges it reads
+    are fetched chunk by chunk into the cache, and the chunks after the one
+    being read are prefetched, so seeking inside watched regions is served
+    from disk. HLS playlists are rewritten so their segments go through the
+    proxy too. Only http and https URLs handed out this way are served.
+    """
+
+    READ_AHEAD = 16
+
+    def __init__(self, cache):
+        import http.server
+
+        class Handler(MediaCacheHandler, http.server.BaseHTTPRequestHandler):
+            pass
+
+        self.cache = cache
+        self.prefetch_queue = queue.Queue()
+        self.queued = set()
+        self.registered = set()
+        self.lock = threading.Lock()
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.proxy = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        for _ in range(2):
+            threading.Thread(target=self.prefetch, daemon=True).start()
+
+    def proxy_url(self, url):
+        import urllib.parse
+
+        if not is_remote_url(url):
+            raise ValueError(f"Not an http or https URL: {url}")
+        with self.lock:
+            self.registered.add(url)
+        token = base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii")
+        name = os.path.basename(urllib.parse.urlparse(url).path)
+        return f"http://127.0.0.1:{self.server.server_port}/{token}/{name}"
+
+    def is_registered(self, url):
+        with self.lock:
+            return url in self.registered and is_remote_url(url)
+
+    def playlist(self, url):
+        """Fetch the HLS playlist at URL and point its URIs at the proxy."""
+        import urllib.parse
+        import urllib.request
+
+        with urllib.request.urlopen(url, timeout=30) as response:
+            text = response.read().decode("utf-8")
+
+        def proxied(uri):
+            uri = urllib.parse.urljoin(url, uri)
+            # Leave anything that isn't http(s) unproxied, the proxy won't serve it.
+            return self.proxy_url(uri) if is_remote_url(uri) else uri
+
+        lines = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#"):
+                line = proxied(stripped)
+            elif 'URI="' in line:
+                line = re.sub(
+                    r'URI="([^"]+)"', lambda m: f'URI="{proxied(m.group(1))}"', line
+                )
+            lines.append(line)
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def read_ahead(self, url, index):
+        last = min(
+            index + self.READ_AHEAD,
+            (self.cache.size(url) - 1) // SegmentCache.CHUNK_SIZE,
+        )
+        with self.lock:
+            for next_index in range(index + 1, last + 1):
+                key = (url, next_index)
+                if key not in self.queued and not self.cache.is_cached(url, next_index):
+                    self.queued.add(key)
+                    self.prefetch_queue.put(key)
+
+    def prefetch(self):
+        while True:
+            url, index = self.prefetch_queue.get()
+            try:
+                self.cache.chunk(url, index)
+            except (OSError, ValueError):
+                pass
+            with self.lock:
+                self.queued.discard((url, index))
+
+    def fetch_file(self, url, suffix):
+        """Download the small file at URL, e.g. a subtitle, into the cache directory."""
+        path = self.cache.resource_directory(url) + suffix
+        if not os.path.exists(path):
+            import urllib.request
+
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return path
+
+
+media_cache = None
+
+
+def media_cache_proxy():
+    global media_cache
+    if media_cache is None:
+        media_cache = MediaCacheProxy(
+            SegmentCache(
+                cache_directory("http"),
+                int(get_emacs_var("eaf-video-player-http-cache-size")) * 1024 * 1024,
+            )
+        )
+    return media_cache
+
+
+def discover_subtitles(video_path, languages):
+    """Return the subtitle files of VIDEO_PATH, best first, and the timeline
+    of the best one. Blocking."""
+    candidates = find_subtitle_files(video_path, languages)
+    if not candidates:
+        return candidates, CueTimeline()
+    return candidates, load_cue_timeline(candidates[0])
+
+
+class SubtitleLoader(QtCore.QObject):
+    """Find and parse the subtitles of a local video off the GUI thread."""
+
+    loaded = QtCore.pyqtSignal(str, list, object)
+    track_loaded = QtCore.pyqtSignal(str, str, object)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def load_track(self, video_path, subtitle_path):
+        """Parse the chosen SUBTITLE_PATH of VIDEO_PATH."""
+
+        def run():
+            try:
+                timeline = load_cue_timeline(subtitle_path)
+            except (OSError, ValueError) as e:
+                self.failed.emit(video_path, f"Error loading {subtitle_path}: {e}")
+                return
+            self.track_loaded.emit(video_path, subtitle_path, timeline)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def load(self, video_path, languages):
+        def run():
+            try:
+                self.loaded.emit(video_path, *discover_subtitles(video_path, languages))
+            except (OSError, ValueError) as e:
+                self.failed.emit(video_path, f"Error loading subtitles: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class RemoteSubtitles(QtCore.QObject):
+    """Look for subtitle sidecars next to a remote video and cache the first found."""
+
+    fetched = QtCore.pyqtSignal(str, str)
+    missing = QtCore.pyqtSignal(str)
+
+    def find(self, video_url, languages):
+        proxy = media_cache_proxy()
+
+        def run():
+            import urllib.parse
+
+            parsed = urllib.parse.urlparse(video_url)
+            base = parsed._replace(path=os.path.splitext(parsed.path)[0]).geturl()
+            for tag in [""] + ["." + language for language in languages]:
+                for extension in SUBTITLE_EXTENSIONS:
+                    try:
+                        path = proxy.fetch_file(base + tag + extension, extension)
+                    except (OSError, ValueError):
+                        continue
+                    self.fetched.emit(video_url, path)
+                    return
+            self.missing.emit(video_url)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class EmbeddedSubtitles(QtCore.QObject):
+    """List and extract text subtitle streams embedded in a video.
+
+    Uses the local ffprobe and ffmpeg on a background thread. Stream lists
+    and extracted tracks (converted to SubRip) are cached under the EAF
+    config dir, keyed by `file_cache_key', so reopening needs neither.
+    """
+
+    TEXT_CODECS = ("subrip", "srt", "ass", "ssa", "webvtt", "mov_text", "text")
+
+    listed = QtCore.pyqtSignal(str, list)
+    extracted = QtCore.pyqtSignal(str, str)
+    missing = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str, str)
+
+    @staticmethod
+    def label(stream):
+        parts = [f"#{stream['stream']}", stream["language"], stream["title"]]
+        return " ".join(part for part in parts if part) + f" ({stream['codec']})"
+
+    def cache_prefix(self, video_path):
+        return os.path.join(cache_directory("embedded"), file_cache_key(video_path))
+
+    def list_streams(self, video_path):
+        """Return the text subtitle streams of VIDEO_PATH. Blocking."""
+        index_path = self.cache_prefix(video_path) + ".json"
+        try:
+            with open(index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        output = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "s",
+                "-show_entries",
+                "stream=codec_name:stream_tags=language,title",
+                "-of",
+                "json",
+                video_path,
+            ],
+            capture_output=True,
+            check=True,
+        ).stdout
+        streams = []
+        for number, info in enumerate(json.loads(output).get("streams", [])):
+            tags = info.get("tags", {})
+            if info.get("codec_name") in self.TEXT_CODECS:
+                streams.append(
+                    {
+                        "stream": number,
+                        "codec": info["codec_name"],
+                        "language": tags.get("language", ""),
+                        "title": tags.get("title", ""),
+                    }
+                )
 
-    def mouseReleaseEvent(self, event):
-        self.is_press = False
+        with open(index_path, "w") as f:
+            json.dump(streams, f)
+        return streams
 
-    def mouseMoveEvent(self, event):
-        if self.is_press:
-            self.progress_changed.emit(event.position().x() * 1.0 / self.width())
+    def extract_stream(self, video_path, stream):
+        """Extract STREAM of VIDEO_PATH to a SubRip file and return its path. Blocking."""
+        subtitle_path = f"{self.cache_prefix(video_path)}.{stream['stream']}.srt"
+        if not os.path.exists(subtitle_path):
+            temp_path = f"{subtitle_path}.{threading.get_ident()}.tmp"
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-v",
+                    "error",
+                    "-nostdin",
+                    "-y",
+                    "-i",
+                    video_path,
+                    "-map",
+                    f"0:s:{stream['stream']}",
+                    "-f",
+                    "srt",
+                    temp_path,
+                ],
+                capture_output=True,
+                check=True,
+            )
+            os.replace(temp_path, subtitle_path)
+        return subtitle_path
 
-    def paintEvent(self, event):
-        painter = QPainter(self)
+    def run_in_background(self, video_path, func, *args):
+        def run():
+            try:
+                func(video_path, *args)
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                self.failed.emit(video_path, f"Error reading embedded subtitles: {e}")
 
-        render_y = (self.height() - self.render_height) / 2
+        threading.Thread(target=run, daemon=True).start()
 
-        painter.setPen(self.background_color)
-        painter.setBrush(self.background_color)
-        painter.drawRect(0, int(render_y), int(self.width()), int(self.render_height))
+    def list(self, video_path):
+        def run(video_path):
+            self.listed.emit(video_path, self.list_streams(video_path))
 
-        if self.duration > 0:
-            painter.setPen(self.foreground_color)
-            painter.setBrush(self.foreground_color)
-            painter.drawRect(
-                0,
-                int(render_y),
-                int(self.width() * self.position / self.duration),
-                int(self.render_height),
+        self.run_in_background(video_path, run)
+
+    def extract(self, video_path, stream):
+        def run(video_path):
+            self.extracted.emit(video_path, self.extract_stream(video_path, stream))
+
+        self.run_in_background(video_path, run)
+
+    def find(self, video_path, languages):
+        """List the streams of VIDEO_PATH and extract the one best matching LANGUAGES."""
+
+        def run(video_path):
+            try:
+                streams = self.list_streams(video_path)
+            except FileNotFoundError:
+                # Without ffprobe there is nothing embedded we could read.
+                streams = []
+            self.listed.emit(video_path, streams)
+            if not streams:
+                self.missing.emit(video_path)
+                return
+
+            def rank(stream):
+                language = stream["language"].lower()
+                if language in languages:
+                    return languages.index(language)
+                return len(languages)
+
+            stream = min(streams, key=rank)
+            self.extracted.emit(video_path, self.extract_stream(video_path, stream))
+
+        self.run_in_background(video_path, run)
+
+
+# Frames per second of the speech activity envelopes used by `SubtitleSync'.
+SYNC_RATE = 100
+
+
+def audio_energy(video_path, rate, audio_filter=None):
+    """Decode the audio of VIDEO_PATH with ffmpeg, mixed to mono at 8 kHz.
+
+    Returns a float32 array with the mean square of the 16-bit samples in
+    each 1/RATE second, after AUDIO_FILTER if given.
+    """
+    import numpy
+
+    sample_rate = 8000
+    frame_size = sample_rate // rate
+    # fmt: off
+    command = [
+        "ffmpeg", "-v", "error", "-nostdin", "-i", video_path,
+        "-vn", "-ac", "1", "-ar", str(sample_rate),
+    ]
+    # fmt: on
+    if audio_filter is not None:
+        command += ["-af", audio_filter]
+    command += ["-f", "s16le", "-"]
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    energies = []
+    chunk_size = frame_size * rate * 60 * 2  # one minute of 16-bit samples
+    remainder = b""
+    while True:
+        data = process.stdout.read(chunk_size)
+        if not data:
+            break
+        data = remainder + data
+        usable = len(data) - len(data) % (frame_size * 2)
+        remainder = data[usable:]
+        samples = numpy.frombuffer(data[:usable], dtype=numpy.int16)
+        frames = samples.astype(numpy.float32).reshape(-1, frame_size)
+        energies.append(numpy.einsum("ij,ij->i", frames, frames) / frame_size)
+    if process.wait() != 0 or not energies:
+        raise ValueError("Could not decode the audio track.")
+    return numpy.concatenate(energies).astype(numpy.float32)
+
+
+def audio_activity(video_path, rate=SYNC_RATE):
+    """Return the speech activity envelope of VIDEO_PATH.
+
+    A float32 array with one value in [0, 1] per 1/RATE second: the log
+    energy of the speech band, scaled between its 30th and 90th
+    percentile. Envelopes are cached on disk, keyed by `file_cache_key'.
+    """
+    import numpy
+
+    cache_path = os.path.join(
+        cache_directory("audio"), f"{file_cache_key(video_path)}.{rate}.f32"
+    )
+    if os.path.exists(cache_path):
+        return numpy.fromfile(cache_path, dtype=numpy.float32)
+
+    energy = audio_energy(video_path, rate, "highpass=f=200,lowpass=f=3000")
+    energy = numpy.log10(energy + 1.0)
+    low, high = numpy.percentile(energy, (30, 90))
+    activity = numpy.clip((energy - low) / max(high - low, 1e-6), 0, 1)
+    activity = activity.astype(numpy.float32)
+    activity.tofile(cache_path)
+    return activity
+
+
+def audio_loudness(video_path, rate=SYNC_RATE):
+    """Return the loudness of VIDEO_PATH in dBFS, one float32 per 1/RATE second.
+
+    Unlike `audio_activity' this is the whole band and not relative to the
+    file, so a fixed threshold tells silence from quiet sound.
+    """
+    import numpy
+
+    cache_path = os.path.join(
+        cache_directory("audio"), f"{file_cache_key(video_path)}.{rate}.dbfs.f32"
+    )
+    if os.path.exists(cache_path):
+        return numpy.fromfile(cache_path, dtype=numpy.float32)
+
+    energy = audio_energy(video_path, rate)
+    loudness = 10 * numpy.log10(energy / 32768.0**2 + 1e-12)
+    loudness = loudness.astype(numpy.float32)
+    loudness.tofile(cache_path)
+    return loudness
+
+
+def cue_activity(timeline, length, rate=SYNC_RATE):
+    """Return a float32 array of LENGTH frames, 1 where a cue of TIMELINE is shown."""
+    import numpy
+
+    scale = rate / 1000
+    starts = numpy.clip(
+        (numpy.asarray(timeline.starts) * scale).astype(numpy.int64), 0, length
+    )
+    ends = numpy.clip(
+        (numpy.asarray(timeline.ends) * scale).astype(numpy.int64), 0, length
+    )
+    steps = numpy.zeros(length + 1, dtype=numpy.int32)
+    numpy.add.at(steps, starts, 1)
+    numpy.add.at(steps, ends, -1)
+    return (numpy.cumsum(steps[:-1]) > 0).astype(numpy.float32)
+
+
+def correlation_peak(audio, cues, min_lag, max_lag):
+    """Return the lag in [MIN_LAG, MAX_LAG] at which CUES best match AUDIO,
+    and the normalized correlation at that lag.
+
+    A lag of K matches `cues[t]' with `audio[t + K]'.
+    """
+    import numpy
+
+    audio = audio - audio.mean()
+    cues = cues - cues.mean()
+    size = 1 << (len(audio) + len(cues)).bit_length()
+    correlation = numpy.fft.irfft(
+        numpy.fft.rfft(audio, size) * numpy.conj(numpy.fft.rfft(cues, size)), size
+    )
+    lags = numpy.arange(min_lag, max_lag + 1)
+    values = correlation[lags % size]
+    best = int(numpy.argmax(values))
+    norm = float(numpy.linalg.norm(audio) * numpy.linalg.norm(cues)) or 1.0
+    return int(lags[best]), float(values[best]) / norm
+
+
+def estimate_sync(audio, cues, rate=SYNC_RATE, max_offset=120, window=600, search=20):
+    """Estimate how to move CUES onto AUDIO, two activity envelopes at RATE.
+
+    The global offset is searched within MAX_OFFSET seconds. Drift is then
+    fitted over the local offsets of WINDOW second windows, each searched
+    within SEARCH seconds of the global one. Returns (OFFSET, DRIFT) such
+    that a cue at T milliseconds belongs at T + OFFSET + DRIFT * T.
+    """
+    import numpy
+
+    max_lag = max_offset * rate
+    offset, score = correlation_peak(audio, cues, -max_lag, max_lag)
+    if score <= 0:
+        raise ValueError("Subtitles do not match the audio.")
+
+    centers = []
+    lags = []
+    weights = []
+    window_frames = window * rate
+    search_frames = search * rate
+    for start in range(0, len(cues) - window_frames // 2, window_frames):
+        end = min(start + window_frames, len(cues))
+        segment = cues[start:end]
+        if not segment.any():
+            continue
+
+        audio_start = max(0, start + offset - search_frames)
+        audio_end = min(len(audio), end + offset + search_frames)
+        if audio_end - audio_start < end - start:
+            continue
+        lag, local_score = correlation_peak(
+            audio[audio_start:audio_end],
+            segment,
+            max(0, start + offset - search_frames - audio_start),
+            start + offset + search_frames - audio_start,
+        )
+        if local_score > 0:
+            centers.append((start + end) / 2)
+            lags.append(audio_start + lag - start)
+            weights.append(local_score)
+
+    drift = 0.0
+    if len(centers) >= 3:
+        slope, intercept = numpy.polyfit(centers, lags, 1, w=weights)
+        # Frame rate conversions drift by a few percent at most.
+        if abs(slope) < 0.1:
+            drift = float(slope)
+            offset = intercept
+
+    return offset * 1000 / rate, drift
+
+
+def shift_timeline(timeline, offset, drift):
+    """Return a copy of TIMELINE with every time T moved to T + OFFSET + DRIFT * T."""
+    import numpy
+
+    def shift(values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        shifted = numpy.maximum(numpy.rint(values * (1 + drift) + offset), 0)
+        return array("q", shifted.astype(numpy.int64).tobytes())
+
+    return CueTimeline.from_arrays(
+        shift(timeline.starts),
+        shift(timeline.ends),
+        shift(timeline.max_ends),
+        timeline.texts,
+    )
+
+
+# A cue time in SubRip, WebVTT or ASS: [H:]MM:SS followed by , or . and 2-3 digits.
+SUBTITLE_TIME = re.compile(r"(?:(\d+):)?(\d{2}):(\d{2})([,.])(\d{2,3})")
+
+
+def shift_subtitle_file(path, offset, drift):
+    """Move every cue time in the subtitle file at PATH like `shift_timeline' does.
+
+    Only the timestamps of SubRip/WebVTT timing lines and ASS dialogue
+    lines are rewritten, in their own format; text, tags, line breaks and
+    bytes that are not UTF-8 are left as they are.
+    """
+
+    def shift(match):
+        hours, minutes, seconds, separator, fraction = match.groups()
+        scale = 10 ** (3 - len(fraction))
+        time_ = (
+            (int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)
+        ) * 1000 + int(fraction) * scale
+        time_ = max(round(time_ * (1 + drift) + offset), 0)
+        time_, fraction = divmod(time_ // scale, 1000 // scale)
+        time_, seconds = divmod(time_, 60)
+        hours, minutes = divmod(time_, 60)
+        text = f"{minutes:02}:{seconds:02}{separator}{fraction:0{len(match.group(5))}}"
+        if match.group(1) is not None or hours:
+            text = f"{hours:0{len(match.group(1) or '00')}}:" + text
+        return text
+
+    with open(path, "rb") as f:
+        text = f.read().decode("utf-8", errors="surrogateescape")
+    lines = text.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        if "-->" in line:
+            lines[index] = SUBTITLE_TIME.sub(shift, line)
+        elif line.lstrip().lower().startswith("dialogue:"):
+            lines[index] = SUBTITLE_TIME.sub(shift, line, count=2)
+
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write("".join(lines).encode("utf-8", errors="surrogateescape"))
+    os.replace(temp_path, path)
+
+
+class SubtitleSync(QtCore.QObject):
+    """Align a subtitle timeline to the speech in the audio track, in the background.
+
+    With WRITE_BACK the subtitle file itself is shifted too, from the same
+    thread. Needs numpy and the local ffmpeg.
+    """
+
+    synced = QtCore.pyqtSignal(str, str, object, float, float, bool)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self):
+        super(SubtitleSync, self).__init__()
+        self.running = False
+
+    def start(self, video_path, subtitle_path, timeline, write_back=False):
+        if self.running:
+            return False
+
+        self.running = True
+        threading.Thread(
+            target=self.run,
+            args=(video_path, subtitle_path, timeline, write_back),
+            daemon=True,
+        ).start()
+        return True
+
+    def run(self, video_path, subtitle_path, timeline, write_back):
+        try:
+            audio = audio_activity(video_path)
+            cues = cue_activity(timeline, len(audio))
+            offset, drift = estimate_sync(audio, cues)
+            shifted = shift_timeline(timeline, offset, drift)
+            written = write_back and self.write_back(
+                video_path, subtitle_path, offset, drift
             )
+            self.synced.emit(video_path, subtitle_path, shifted, offset, drift, written)
+        except ImportError:
+            self.failed.emit(video_path, "Subtitle auto-sync needs numpy.")
+        except (OSError, ValueError) as e:
+            self.failed.emit(video_path, f"Error synchronizing subtitles: {e}")
+        finally:
+            self.running = False
+
+    def write_back(self, video_path, subtitle_path, offset, drift):
+        """Shift SUBTITLE_PATH after backing it up, return whether it was written."""
+        try:
+            if not os.path.exists(subtitle_path + ".orig"):
+                shutil.copyfile(subtitle_path, subtitle_path + ".orig")
+            shift_subtitle_file(subtitle_path, offset, drift)
+        except OSError as e:
+            self.failed.emit(video_path, f"Could not write {subtitle_path}: {e}")
+            return False
+        return True
+
+
+class SilenceMap:
+    """Silent spans of a video, as sorted start and end arrays in milliseconds."""
+
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span_at(self, position):
+        """Return the index of the span containing POSITION, or None."""
+        index = bisect_right(self.starts, position) - 1
+        if index >= 0 and position < self.ends[index]:
+            return index
+        return None
+
+    def next_start(self, position):
+        index = bisect_right(self.starts, position)
+        return self.starts[index] if index < len(self.starts) else None
+
+    def total(self):
+        return sum(self.ends) - sum(self.starts)
+
+
+def silent_spans(loudness, min_duration, threshold, margin=150, rate=SYNC_RATE):
+    """Return (STARTS, ENDS) in milliseconds of the runs of LOUDNESS below THRESHOLD
+    dBFS lasting at least MIN_DURATION milliseconds, each shrunk by MARGIN on both sides.
+    """
+    import numpy
+
+    quiet = numpy.concatenate(([False], loudness < threshold, [False]))
+    edges = numpy.flatnonzero(numpy.diff(quiet.astype(numpy.int8)))
+    starts = edges[0::2] * 1000 // rate + margin
+    ends = edges[1::2] * 1000 // rate - margin
+    keep = ends - starts >= max(min_duration - 2 * margin, 1)
+    return array("q", starts[keep].astype(numpy.int64).tobytes()), array(
+        "q", ends[keep].astype(numpy.int64).tobytes()
+    )
+
+
+def load_silence_map(video_path, min_duration, threshold):
+    """Find the silent spans of VIDEO_PATH, going through the on-disk cache."""
+    cache_path = os.path.join(
+        cache_directory("silence"),
+        f"{file_cache_key(video_path)}.{min_duration}.{threshold}.q",
+    )
+    try:
+        with open(cache_path, "rb") as f:
+            spans = array("q", f.read())
+        return SilenceMap(spans[0::2], spans[1::2])
+    except OSError:
+        pass
+
+    starts, ends = silent_spans(audio_loudness(video_path), min_duration, threshold)
+    spans = array("q", bytes(16 * len(starts)))
+    spans[0::2] = starts
+    spans[1::2] = ends
+    temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(spans.tobytes())
+    os.replace(temp_path, cache_path)
+    return SilenceMap(starts, ends)
+
+
+class SilenceDetector(QtCore.QObject):
+    """Build the SilenceMap of a video in the background. Needs numpy and ffmpeg."""
+
+    found = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def start(self, video_path, min_duration, threshold):
+        def run():
+            try:
+                self.found.emit(
+                    video_path, load_silence_map(video_path, min_duration, threshold)
+                )
+            except ImportError:
+                self.failed.emit(video_path, "Silence skipping needs numpy.")
+            except (OSError, ValueError) as e:
+                self.failed.emit(video_path, f"Error finding silent spans: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def lookup_key(word):
+    """The form of WORD sent to the dictionary, without surrounding punctuation."""
+    return word.strip(string.punctuation + "“”‘’«»…—")
+
+
+class LookupCache:
+    """LRU cache of dictionary lookups done by Emacs, shared by every buffer."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.requested = set()
+
+    def get(self, word):
+        result = self.results.get(word)
+        if result is not None:
+            self.results.move_to_end(word)
+        return result
+
+    def put(self, word, result):
+        self.results[word] = result
+        self.results.move_to_end(word)
+        while len(self.results) > self.max_entries:
+            evicted, _ = self.results.popitem(last=False)
+            self.requested.discard(evicted)
+
+    def should_prefetch(self, word):
+        """Return True the first time WORD is seen and its result is not cached."""
+        if word in self.results or word in self.requested:
+            return False
+        if len(self.requested) > self.max_entries:
+            self.requested.clear()
+        self.requested.add(word)
+        return True
+
+
+lookup_cache = LookupCache()
+
+
+SUBTITLE_OUTLINE_WIDTH = 3
+
+
+def subtitle_font():
+    font = QFont("Alegreya")
+    font.setPixelSize(50)
+    return font
+
+
+def subtitle_outline_pen():
+    pen = QPen(QColor("black"), SUBTITLE_OUTLINE_WIDTH)
+    pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+    return pen
+
+
+def layout_cue(text, font, max_width):
+    """Tokenize cue TEXT and wrap the words the way the subtitle overlay shows them.
+
+    Return a list of (word, QRectF) pairs, the rects include the outline
+    margin and are relative to the top-left corner of the cue.
+    """
+    metrics = QFontMetricsF(font)
+    margin = SUBTITLE_OUTLINE_WIDTH
+    height = metrics.height() + margin * 2
+    x_offset = 0
+    y_offset = 0
+    boxes = []
+    for word in re.sub(r"<[^>]+>", "", text).split():
+        width = metrics.horizontalAdvance(word) + margin * 2
+        boxes.append((word, QRectF(x_offset, y_offset, width, height)))
+        x_offset += width + 5
+        if x_offset >= max_width:
+            x_offset = 0
+            y_offset += height + 1
+    return boxes
+
+
+def word_path(word, font, x, y):
+    """Glyph outline of WORD with its box's top-left corner at X, Y."""
+    path = QPainterPath()
+    margin = SUBTITLE_OUTLINE_WIDTH
+    path.addText(x + margin, y + margin + QFontMetricsF(font).ascent(), font, word)
+    return path
+
+
+class CueRaster:
+    """A laid out and painted cue: one image plus the hit box of every word."""
+
+    def __init__(self, image, boxes):
+        self.image = image
+        self.boxes = boxes
+
+    def size_in_bytes(self):
+        return self.image.sizeInBytes()
+
+
+def rasterize_cue(text, font, max_width):
+    boxes = layout_cue(text, font, max_width)
+    bounds = QRectF()
+    for _, rect in boxes:
+        bounds = bounds.united(rect)
+
+    image = QImage(
+        max(1, ceil(bounds.width())),
+        max(1, ceil(bounds.height())),
+        QImage.Format.Format_ARGB32_Premultiplied,
+    )
+    image.fill(Qt.GlobalColor.transparent)
+
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    pen = subtitle_outline_pen()
+    fill = QColor("white")
+    for word, rect in boxes:
+        path = word_path(word, font, rect.x(), rect.y())
+        painter.strokePath(path, pen)
+        painter.fillPath(path, fill)
+    painter.end()
+
+    return CueRaster(image, boxes)
+
+
+class CueRenderCache:
+    """LRU cache of CueRaster, bounded by the bytes of its images.
+
+    Filled from the rasterizer thread and read from the GUI thread.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.rasters = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.rasters
+
+    def get(self, key):
+        with self.lock:
+            raster = self.rasters.get(key)
+            if raster is not None:
+                self.rasters.move_to_end(key)
+            return raster
+
+    def put(self, key, raster):
+        with self.lock:
+            old_raster = self.rasters.pop(key, None)
+            if old_raster is not None:
+                self.total_bytes -= old_raster.size_in_bytes()
+            self.rasters[key] = raster
+            self.total_bytes += raster.size_in_bytes()
+            while self.total_bytes > self.max_bytes and len(self.rasters) > 1:
+                _, evicted = self.rasters.popitem(last=False)
+                self.total_bytes -= evicted.size_in_bytes()
+
+    def clear(self):
+        with self.lock:
+            self.rasters.clear()
+            self.total_bytes = 0
+
+
+class CueRasterizer:
+    """Daemon thread that lays out and paints upcoming cues into a CueRenderCache.
+
+    Every `request' replaces the pending jobs, so after a seek the thread
+    does not keep working on cues that are no longer ahead of the playhead.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.condition = threading.Condition()
+        self.pending = []
+        self.stopped = False
+        self.thread = None
+
+    def request(self, jobs):
+        with self.condition:
+            self.pending = [job for job in jobs if job[0] not in self.cache]
+            self.condition.notify()
+
+        if self.thread is None and self.pending:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending = []
+            self.condition.notify()
+
+    def run(self):
+        # QFont is not thread-safe, the worker keeps its own instance.
+        font = subtitle_font()
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                key, text, max_width = self.pending.pop(0)
+
+            if key not in self.cache:
+                self.cache.put(key, rasterize_cue(text, font, max_width))
 
 
 class Subtitles(QtWidgets.QGraphicsTextItem):
+    timeline_changed = QtCore.pyqtSignal()
+
     def __init__(self, video_player: VideoPlayer):
         super(Subtitles, self).__init__()
         self.video_player = video_player
-        self.x_offset = 0
-        self.y_offset = 0
-        self.subs = []
-        self.current_sub = None
+        self.timeline = CueTimeline()
+        self.timeline_generation = 0
+        self.current_cues = ()
+        self.word_pool = []
+        self.words = []
 
-    def searchSubtitlesFile(self, url):
-        base = os.path.splitext(url)[0]
-        directory = os.path.dirname(url)
-        srt_files = [f for f in os.listdir(directory) if f.endswith(".srt")]
-        for srt_file in srt_files:
-            srt_path = os.path.join(directory, srt_file)
-            if srt_path.startswith(base):
-                return srt_path
+        settings = video_player.settings
+        self.word_font = subtitle_font()
+        self.font_key = self.word_font.key()
+        self.lookahead = int(settings["eaf-video-player-subtitle-lookahead"])
+        self.render_cache = CueRenderCache(
+            int(settings["eaf-video-player-subtitle-cache-size"]) * 1024 * 1024
+        )
+        self.rasterizer = CueRasterizer(self.render_cache)
+        self.cue_image = CueImageItem(self)
+        self.cue_image.hide()
+
+        self.languages = settings["eaf-video-player-subtitle-languages"] or []
+
+        self.video_url = None
+        self.embedded_streams = []
+        self.embedded_select_pending = False
+        self.embedded = EmbeddedSubtitles()
+        self.embedded.listed.connect(self.embedded_listed)
+        self.embedded.extracted.connect(self.embedded_extracted)
+        self.embedded.missing.connect(self.missing)
+        self.embedded.failed.connect(self.embedded_failed)
+        self.remote = RemoteSubtitles()
+        self.remote.fetched.connect(self.remote_fetched)
+        self.remote.missing.connect(self.missing)
+        self.loader = SubtitleLoader()
+        self.loader.loaded.connect(self.loaded)
+        self.loader.track_loaded.connect(self.track_loaded)
+        self.loader.failed.connect(self.embedded_failed)
+        self.sync = SubtitleSync()
+        self.sync.synced.connect(self.synced)
+        self.sync.failed.connect(self.sync_failed)
+
+        self.lookup_prefetch = int(settings["eaf-video-player-lookup-prefetch"])
+        self.pending_lookup = None
+        self.lookup_word = None
+        self.lookup_timer = QtCore.QTimer()
+        self.lookup_timer.setSingleShot(True)
+        self.lookup_timer.setInterval(150)
+        self.lookup_timer.timeout.connect(self.send_lookup)
+        self.candidates = []
+        self.subtitle_url = None
+        self.search_index = None
 
     def open(self, url):
-        subtitle_url = self.searchSubtitlesFile(url)
+        self.video_url = url
+        if is_remote_url(url):
+            self.candidates = []
+            self.close_track()
+            self.remote.find(url, self.languages)
+            return
+
+        self.candidates = []
+        self.close_track()
+        self.loader.load(url, self.languages)
+
+    def loaded(self, video_url, candidates, timeline):
+        if video_url != self.video_url:
+            return
+
+        self.candidates = candidates
+        if candidates:
+            self.subtitle_url = candidates[0]
+            emacs_channel.message(
+                f"Subtitle is: {candidates[0]}",
+                kind="subtitle",
+                owner=self.video_player,
+            )
+            self.set_timeline(timeline)
+        else:
+            emacs_channel.message(
+                "Looking for embedded subtitles.",
+                kind="subtitle",
+                owner=self.video_player,
+            )
+            self.embedded.find(video_url, self.languages)
+
+    def release(self):
+        self.rasterizer.request([])
+        self.set_timeline(CueTimeline())
+        self.cue_image.set_raster(None)
+        for word in self.word_pool:
+            word.setParentItem(None)
+            if word.scene() is not None:
+                word.scene().removeItem(word)
+        self.word_pool = []
+        self.timeline_changed.emit()
+
+    def restore(self):
+        if self.subtitle_url and os.path.exists(self.subtitle_url):
+            self.loader.load_track(self.video_url, self.subtitle_url)
+
+    def memory_usage(self):
+        return {
+            "timeline": self.timeline.size_in_bytes(),
+            "render_cache": self.render_cache.total_bytes,
+        }
+
+    def close_track(self):
+        self.subtitle_url = None
+        self.timeline = CueTimeline()
+        self.timeline_generation += 1
+        self.current_cues = ()
+        self.clear()
+        self.timeline_changed.emit()
+
+    def embedded_listed(self, video_url, streams):
+        if video_url != self.video_url:
+            return
+        self.embedded_streams = streams
+        if self.embedded_select_pending:
+            self.embedded_select_pending = False
+            if streams:
+                emacs_channel.call(
+                    "eaf-video-player--select-subtitle-track",
+                    "open_embedded_subtitle",
+                    *[EmbeddedSubtitles.label(stream) for stream in streams],
+                )
+            else:
+                emacs_channel.message("There are no embedded text subtitles.")
+
+    def embedded_extracted(self, video_url, subtitle_url):
+        if video_url == self.video_url:
+            self.open_track(subtitle_url)
+
+    def remote_fetched(self, video_url, subtitle_url):
+        if video_url == self.video_url:
+            self.candidates = [subtitle_url]
+            self.open_track(subtitle_url)
+
+    def missing(self, video_url):
+        if video_url == self.video_url:
+            emacs_channel.message(
+                "There is no subtitles.", kind="subtitle", owner=self.video_player
+            )
+
+    def embedded_failed(self, video_url, error):
+        if video_url == self.video_url:
+            emacs_channel.message(error)
+
+    def synced(self, video_url, subtitle_url, timeline, offset, drift, written):
+        if video_url != self.video_url or subtitle_url != self.subtitle_url:
+            return
+
+        self.set_timeline(timeline)
+        message = f"Subtitles moved by {offset / 1000:+.2f}s, drift {drift * 100:+.3f}%"
+        if written:
+            message += f", written to {subtitle_url}"
+        emacs_channel.message(message + ".", kind="subtitle", owner=self.video_player)
+
+    def sync_failed(self, video_url, error):
+        # Not coalesced, a failed write-back comes with the synced message.
+        if video_url == self.video_url:
+            emacs_channel.message(error)
+
+    def open_track(self, subtitle_url):
+        self.subtitle_url = subtitle_url
         if subtitle_url and os.path.exists(subtitle_url):
-            message_to_emacs(f"Subtitle is: {subtitle_url}")
-            self.subs = pysrt.open(subtitle_url, encoding="utf-8")
+            emacs_channel.message(
+                f"Subtitle is: {subtitle_url}", kind="subtitle", owner=self.video_player
+            )
+            self.loader.load_track(self.video_url, subtitle_url)
         else:
-            message_to_emacs("There is no subtitles.")
+            emacs_channel.message(
+                "There is no subtitles.", kind="subtitle", owner=self.video_player
+            )
+            self.set_timeline(CueTimeline())
+
+    def track_loaded(self, video_url, subtitle_url, timeline):
+        # Ignore a track chosen before the latest one, or for another video.
+        if video_url == self.video_url and subtitle_url == self.subtitle_url:
+            self.set_timeline(timeline)
+
+    def set_timeline(self, timeline):
+        self.timeline = timeline
+        self.timeline_generation += 1
+        self.render_cache.clear()
+        self.current_cues = ()
+        self.clear()
+        self.timeline_changed.emit()
+
+        # Build the search index off the GUI thread, `search' falls back
+        # to building it inline if asked before it is ready.
+        self.search_index = None
+        generation = self.timeline_generation
+
+        def run():
+            search_index = CueIndex(timeline)
+            if generation == self.timeline_generation:
+                self.search_index = search_index
 
-    def parse_srt_time(self, sub_rip_time):
-        total_seconds = (
-            sub_rip_time.hours * 3600
-            + sub_rip_time.minutes * 60
-            + sub_rip_time.seconds
-            + sub_rip_time.milliseconds / 1000.0
+        if len(timeline):
+            threading.Thread(target=run, daemon=True).start()
+
+    @timed("subtitle_search")
+    def search(self, query):
+        """Return the cues matching QUERY as one line each, timestamp first."""
+        if self.search_index is None:
+            self.search_index = CueIndex(self.timeline)
+        return "\n".join(
+            f"{format_srt_time(self.timeline.starts[cue])} {self.timeline.texts[cue]}"
+            for cue in self.search_index.search(query)
         )
-        return total_seconds * 1000
 
+    @timed("update_subtitle")
     def update_subtitle(self, position):
-        for sub in self.subs:
-            start_time = self.parse_srt_time(sub.start)
-            end_time = self.parse_srt_time(sub.end)
-            if start_time <= position and end_time >= position:
-                if self.current_sub != sub:
-                    self.current_sub = sub
-                    self.update_view(sub.text)
-
-    def add_child(self, child: QtWidgets.QGraphicsTextItem):
-        child.setParentItem(self)
-        child.setPos(self.x_offset, self.y_offset)
-        video_size = self.video_player.size()
-        max_width = video_size.width() - 200
-        child_rect = child.boundingRect()
-        self.x_offset += child_rect.width() + 5
-        if self.x_offset >= max_width:
-            self.x_offset = 0
-            self.y_offset += child_rect.height() + 1
+        cues = self.timeline.active(position)
+        if cues != self.current_cues:
+            self.current_cues = cues
+            self.show_cues(cues)
+
+    def max_width(self):
+        return self.video_player.width() - 200
+
+    def cache_key(self, cues):
+        return (self.timeline_generation, cues, self.max_width(), self.font_key)
+
+    def cue_text(self, cues):
+        return " ".join(self.timeline.texts[i] for i in cues)
+
+    @timed("show_cues")
+    def show_cues(self, cues):
+        raster = self.render_cache.get(self.cache_key(cues)) if cues else None
+        if raster is not None:
+            self.clear()
+            self.cue_image.set_raster(raster)
+            self.cue_image.show()
+            self.reposition()
+        else:
+            self.update_view(self.cue_text(cues))
+
+        self.prefetch(cues)
+        self.prefetch_lookups(cues)
+
+    def prefetch(self, cues):
+        """Queue the cues after CUES for layout and rasterization off the GUI thread."""
+        if not cues or self.lookahead <= 0:
+            return
+
+        max_width = self.max_width()
+        first = cues[-1] + 1
+        last = min(len(self.timeline), first + self.lookahead)
+        self.rasterizer.request(
+            [
+                (self.cache_key((index,)), self.timeline.texts[index], max_width)
+                for index in range(first, last)
+            ]
+        )
+
+    def resize_view(self):
+        # Cached rasters were wrapped for the old width.
+        self.render_cache.clear()
+        self.show_cues(self.current_cues)
+
+    def words_rect(self):
+        """Bounding rect of the words currently shown, in Subtitles coordinates.
+
+        Pooled words stay parented while hidden, so `childrenBoundingRect'
+        would also count the idle ones.
+        """
+        if self.cue_image.isVisible():
+            return self.cue_image.mapRectToParent(self.cue_image.boundingRect())
+
+        rect = QRectF()
+        for word in self.words:
+            rect = rect.united(word.mapRectToParent(word.boundingRect()))
+        return rect
+
+    def sentence(self):
+        if self.cue_image.isVisible():
+            return " ".join(word for word, _ in self.cue_image.raster.boxes)
+        return " ".join(word.text() for word in self.words)
 
     def reposition(self):
         video_size = self.video_player.size()
-        subtitle_rect = self.childrenBoundingRect()
+        subtitle_rect = self.words_rect()
         x_position = (video_size.width() - subtitle_rect.width()) / 2
         y_position = (video_size.height() - subtitle_rect.height()) - 60
-        for item in self.childItems():
+        items = [self.cue_image] if self.cue_image.isVisible() else self.words
+        for item in items:
             pos = item.pos()
             item.setPos(x_position + pos.x(), y_position + pos.y())
 
+    @timed("update_view")
     def update_view(self, text: str):
         self.clear()
-        words = text.split()
-        for word in words:
-            word = re.sub(r"<[^>]+>", "", word)
-            subtitle_word = SubtitleWord(word, self.video_player)
-            self.add_child(subtitle_word)
+        for index, (word, rect) in enumerate(
+            layout_cue(text, self.word_font, self.max_width())
+        ):
+            if index < len(self.word_pool):
+                subtitle_word = self.word_pool[index]
+            else:
+                subtitle_word = SubtitleWord(self)
+                self.word_pool.append(subtitle_word)
+            subtitle_word.set_word(word)
+            subtitle_word.setPos(rect.topLeft())
+            subtitle_word.show()
+            self.words.append(subtitle_word)
         self.reposition()
 
     def clear(self):
-        children = self.childItems()
-        self.x_offset = 0
-        self.y_offset = 0
-        for child in children:
-            self.scene().removeItem(child)
-            del child
+        self.cue_image.hide()
+        self.cue_image.setPos(0, 0)
+        for word in self.words:
+            word.hide()
+        self.words = []
 
+    def prefetch_lookups(self, cues):
+        """Ask Emacs, in one call, to look up the words of CUES and the cues after them."""
+        if not cues or self.lookup_prefetch <= 0:
+            return
 
-class SubtitleWord(QtWidgets.QGraphicsTextItem):
-    def __init__(self, text, video_player: VideoPlayer):
-        super(SubtitleWord, self).__init__(text)
-        self.video_player = video_player
+        last = min(len(self.timeline), cues[-1] + 1 + self.lookup_prefetch)
+        words = []
+        for index in range(cues[0], last):
+            for word in self.timeline.texts[index].split():
+                word = lookup_key(word)
+                if word and lookup_cache.should_prefetch(word):
+                    words.append(word)
+        if words:
+            metrics.begin("prefetch_rpc", self.video_player)
+            emacs_channel.call(
+                "eaf-video-player-prefetch", self.video_player.buffer_id, *words
+            )
+
+    def hover_word(self, word, x):
+        self.video_player.media_player.pause()
+        self.cancel_lookup()
+        word = lookup_key(word)
+        if not word:
+            # Only punctuation, there is nothing to look up.
+            return
+
+        self.video_player.ensure_message_box().show()
+        y = self.words_rect().y()
+        result = lookup_cache.get(word)
+        if result is not None:
+            self.video_player.message_box.update(result, x, y)
+        else:
+            # Sweeping the mouse over a line should not flood Emacs with lookups.
+            self.pending_lookup = (word, x, y)
+            self.lookup_timer.start()
+
+    def send_lookup(self):
+        word, x, y = self.pending_lookup
+        self.cancel_lookup()
+        self.lookup_word = word
+        metrics.begin("lookup_rpc", self.video_player)
+        emacs_channel.call(
+            "eaf-video-player-lookup",
+            self.video_player.buffer_id,
+            word,
+            x,
+            y,
+            kind="lookup",
+            owner=self.video_player,
+        )
+
+    def lookup_done(self, word, text):
+        """Cache the reply TEXT for WORD, return whether WORD is still the one awaited.
+
+        A late reply for a word the mouse has since left is not shown.
+        """
+        lookup_cache.put(word, text)
+        if word != self.lookup_word:
+            return False
+        metrics.end("lookup_rpc", self.video_player)
+        self.lookup_word = None
+        return True
+
+    def cancel_lookup(self):
+        """Stop waiting for the pending lookup, its reply will only be cached."""
+        self.lookup_timer.stop()
+        if self.lookup_word is not None:
+            metrics.discard("lookup_rpc", self.video_player)
+            self.lookup_word = None
+
+    def leave_word(self):
+        self.cancel_lookup()
+        self.video_player.media_player.play()
+        if self.video_player.message_box is not None:
+            self.video_player.message_box.hide()
+
+    def explain_sentence(self):
+        # The sentence reply must not end the pending word lookup's span.
+        self.cancel_lookup()
+        self.video_player.media_player.pause()
+        x = self.words_rect().x()
+        y = self.words_rect().y()
+        emacs_channel.call(
+            "eaf-video-player-explain-sentence",
+            self.video_player.buffer_id,
+            self.sentence(),
+            x,
+            y,
+            kind="lookup",
+            owner=self.video_player,
+        )
+
+
+class SubtitleWord(QtWidgets.QGraphicsSimpleTextItem):
+    """One word of the current cue, recycled through `Subtitles.word_pool'.
+
+    Used when the cue has not been rasterized ahead of time. The black
+    outline is stroked from the glyph path in the same paint pass as the
+    fill, instead of a per-word QGraphicsDropShadowEffect that needs an
+    offscreen blur every frame.
+    """
+
+    outline_pen = None
+
+    def __init__(self, subtitles: Subtitles):
+        super(SubtitleWord, self).__init__(subtitles)
+        self.subtitles = subtitles
         self.setAcceptHoverEvents(True)
 
-        # Set Font
-        font = QFont("Alegreya")
-        font.setPixelSize(50)
-        self.setFont(font)
+        # Font and outline are shared by every word.
+        if SubtitleWord.outline_pen is None:
+            SubtitleWord.outline_pen = subtitle_outline_pen()
+        self.setFont(subtitles.word_font)
 
         # Text front color is white
-        self.setDefaultTextColor(QColor("white"))
+        self.setBrush(QColor("white"))
 
-        # Add Black Outline
-        self.setOutlineEffect()
+        self.text_path = QPainterPath()
 
-    def setOutlineEffect(self):
+    def set_word(self, text):
+        if text == self.text():
+            return
+        self.prepareGeometryChange()
+        self.setText(text)
+        self.text_path = word_path(text, self.subtitles.word_font, 0, 0)
 
-        shadow = QtWidgets.QGraphicsDropShadowEffect()
-        shadow.setBlurRadius(3)
-        shadow.setColor(QColor("black"))
-        shadow.setOffset(1, 1)
+    def boundingRect(self):
+        margin = SUBTITLE_OUTLINE_WIDTH * 2
+        return super().boundingRect().adjusted(0, 0, margin, margin)
 
-        self.setGraphicsEffect(shadow)
+    def paint(self, painter, option, widget=None):
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.strokePath(self.text_path, SubtitleWord.outline_pen)
+        painter.fillPath(self.text_path, self.brush())
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.RightButton:
-            self.explain_sentence(event)
+            self.subtitles.explain_sentence()
         else:
             super().mousePressEvent(event)
 
-    def explain_sentence(self, event):
-        self.video_player.media_player.pause()
-        subtitles = self.video_player.subtitles
-        sentence = " ".join([item.toPlainText() for item in subtitles.childItems()])
-        x = subtitles.childrenBoundingRect().x()
-        y = subtitles.childrenBoundingRect().y()
-        eval_in_emacs("eaf-video-player-explain-sentence", [sentence, x, y])
-
     def hoverEnterEvent(self, event):
-        self.video_player.media_player.pause()
-        self.setDefaultTextColor(QColor("green"))
-        scene_pos = self.mapToScene(event.pos())
-        self.video_player.message_box.show()
-        x = scene_pos.x()
-        y = self.parentItem().childrenBoundingRect().y()
-        eval_in_emacs("eaf-video-player-lookup", [self.toPlainText(), x, y])
+        self.setBrush(QColor("green"))
+        self.subtitles.hover_word(self.text(), self.mapToScene(event.pos()).x())
 
     def hoverLeaveEvent(self, event):
-        self.video_player.media_player.play()
-        self.setDefaultTextColor(QColor("white"))
-        self.video_player.message_box.hide()
+        self.setBrush(QColor("white"))
+        self.subtitles.leave_word()
+
+
+class CueImageItem(QtWidgets.QGraphicsItem):
+    """Shows a pre-rasterized cue and maps hover and clicks back to its words."""
+
+    def __init__(self, subtitles: Subtitles):
+        super(CueImageItem, self).__init__(subtitles)
+        self.subtitles = subtitles
+        self.raster = None
+        self.hover_index = -1
+        self.setAcceptHoverEvents(True)
+
+    def set_raster(self, raster):
+        self.prepareGeometryChange()
+        self.raster = raster
+        self.hover_index = -1
+
+    def boundingRect(self):
+        if self.raster is None:
+            return QRectF()
+        return QRectF(self.raster.image.rect())
+
+    def paint(self, painter, option, widget=None):
+        if self.raster is None:
+            return
+
+        painter.drawImage(0, 0, self.raster.image)
+
+        if self.hover_index >= 0:
+            word, rect = self.raster.boxes[self.hover_index]
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.fillPath(
+                word_path(word, self.subtitles.word_font, rect.x(), rect.y()),
+                QColor("green"),
+            )
+
+    def word_at(self, pos):
+        for index, (_, rect) in enumerate(self.raster.boxes):
+            if rect.contains(pos):
+                return index
+        return -1
+
+    def hoverMoveEvent(self, event):
+        index = self.word_at(event.pos())
+        if index == self.hover_index:
+            return
+
+        if index < 0:
+            self.subtitles.leave_word()
+        else:
+            word, _ = self.raster.boxes[index]
+            self.subtitles.hover_word(word, self.mapToScene(event.pos()).x())
+        self.hover_index = index
+        self.update()
+
+    def hoverLeaveEvent(self, event):
+        if self.hover_index >= 0:
+            self.hover_index = -1
+            self.subtitles.leave_word()
+            self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.RightButton:
+            self.subtitles.explain_sentence()
+        else:
+            super().mousePressEvent(event)
 
 
 class MessageBox(QtWidgets.QGraphicsTextItem):
@@ -80,6 +80,7 @@
 ;;
 
 ;;; Require
+(require 'json)
 
 ;;; Code:
 
@@ -100,26 +101,139 @@
 (setq eaf-video-player-keybinding
       '(("SPC" . "toggle_play")
         ("x" . "close_buffer")
+        ("z" . "toggle_silence_skip")
         ("h" . "play_backward")
         ("l" . "play_forward")
+        ("," . "step_frame_backward")
+        ("." . "step_frame_forward")
         ("[" . "decrease_volume")
         ("]" . "increase_volume")
         ("j" . "play_backward_subtitle")
         ("k" . "play_forward_subtitle")
+        ("J" . "play_previous_chapter")
+        ("K" . "play_next_chapter")
         ("f" . "toggle_fullscreen")
         ("d" . "download_subtitles")
+        ("D" . "download_directory_subtitles")
         ("s" . "reload_subtitles")
-        ("r" . "restart")))
+        ("S" . "auto_sync_subtitles")
+        ("/" . "search_subtitles")
+        ("t" . "select_subtitle_track")
+        ("T" . "select_embedded_subtitle")
+        ("r" . "restart")
+        ("a" . "toggle_sentence_repeat")
+        ("n" . "play_next_item")
+        ("p" . "play_previous_item")
+        ("A" . "set_ab_loop")
+        ("M" . "toggle_metrics")
+        ("m" . "show_metrics")))
 
 
 (defcustom eaf-video-extension-list
-  '("avi" "webm" "rmvb" "ogg" "mp4" "mkv" "m4v")
+  '("avi" "webm" "rmvb" "ogg" "mp4" "mkv" "m4v" "m3u")
   "The extension list of video player application."
   :type 'cons)
 
-(defun eaf-video-player--navigate-by-subtitles (&rest subtitles)
-  (print subtitles)
-  (completing-read "navigate by subtitles: " subtitles))
+(defcustom eaf-video-player-subtitle-lookahead 3
+  "How many upcoming subtitle cues are laid out and rendered ahead of time."
+  :type 'integer)
+
+(defcustom eaf-video-player-subtitle-cache-size 64
+  "Memory limit of the rendered subtitle cue cache, in megabytes."
+  :type 'integer)
+
+(defcustom eaf-video-player-subtitle-languages '("en" "eng")
+  "Preferred subtitle language tags, most preferred first.
+A subtitle file named like VIDEO.en.srt matches the tag \"en\"."
+  :type '(repeat string))
+
+(defcustom eaf-video-player-subtitle-download-languages '("en")
+  "Languages `download_subtitles' fetches, as IETF tags."
+  :type '(repeat string))
+
+(defcustom eaf-video-player-lookup-function #'identity
+  "Function called with a subtitle word, returns the text shown when hovering it."
+  :type 'function)
+
+(defcustom eaf-video-player-lookup-prefetch 2
+  "How many upcoming subtitle cues have their words looked up ahead of time.
+Set to 0 to only look up words when they are hovered."
+  :type 'integer)
+
+(defcustom eaf-video-player-http-cache-size 2048
+  "Disk space used to cache remote videos played over HTTP, in megabytes."
+  :type 'integer)
+
+(defcustom eaf-video-player-auto-sync-write-back nil
+  "When non-nil, `auto_sync_subtitles' also shifts the times in the subtitle file.
+The file is first copied to FILE.orig, its text and formatting are kept."
+  :type 'boolean)
+
+(defcustom eaf-video-player-frame-ring-size 120
+  "How many decoded frames frame stepping keeps for instant backward steps."
+  :type 'integer)
+
+(defcustom eaf-video-player-frame-ring-memory 256
+  "Memory frame stepping may use for decoded frames, in megabytes."
+  :type 'integer)
+
+(defcustom eaf-video-player-silence-min-duration 1000
+  "Silent spans shorter than this many milliseconds are not skipped."
+  :type 'integer)
+
+(defcustom eaf-video-player-silence-threshold -50
+  "Audio quieter than this many dBFS counts as silence."
+  :type 'integer)
+
+(defcustom eaf-video-player-silence-rate nil
+  "Playback rate over silent spans when `toggle_silence_skip' is on.
+nil jumps over them instead."
+  :type '(choice (const nil) number))
+
+(defcustom eaf-video-player-chapter-min-length 60
+  "Shortest chapter, in seconds, when chapters are picked from scene cuts."
+  :type 'integer)
+
+(defcustom eaf-video-player-max-loaded-hidden-buffers 3
+  "How many hidden video buffers keep their media and subtitles loaded.
+Older hidden buffers are released and reload when shown again.  nil means no limit."
+  :type '(choice (const nil) integer))
+
+(defcustom eaf-video-player-hidden-buffer-timeout 600
+  "Release a video buffer hidden for longer than this many seconds.  nil means never."
+  :type '(choice (const nil) integer))
+
+(defcustom eaf-video-player-metrics-file nil
+  "When non-nil, `toggle_metrics' also appends every timing sample to this file as JSON lines."
+  :type '(choice (const nil) file))
+
+(defun eaf-video-player--show-metrics (summary)
+  (with-current-buffer (get-buffer-create "*eaf-video-player-metrics*")
+    (let ((inhibit-read-only t))
+      (erase-buffer)
+      (insert summary))
+    (special-mode)
+    (display-buffer (current-buffer))))
+
+(defun eaf-video-player--select-subtitle-track (callback &rest tracks)
+  "Pick one of TRACKS and pass it to the buffer's Python method CALLBACK."
+  (eaf-call-async "execute_function_with_args" eaf--buffer-id callback
+                  (completing-read "Subtitle track: " tracks nil t)))
+
+(defun eaf-video-player--search-subtitles ()
+  (eaf-call-async "execute_function_with_args" eaf--buffer-id "search_subtitle_index"
+                  (read-string "Search subtitles: ")))
+
+(defun eaf-video-player--navigate-by-subtitles (query subtitles)
+  "Pick one of SUBTITLES matching QUERY, newline separated and best first, and seek to it."
+  (let* ((candidates (split-string subtitles "\n"))
+         (collection (lambda (string predicate action)
+                       (if (eq action 'metadata)
+                           '(metadata (display-sort-function . identity))
+                         (complete-with-action action candidates string predicate)))))
+    (eaf-call-async "execute_function_with_args" eaf--buffer-id "seek_to_subtitle"
+                    (completing-read (format "Subtitles matching \"%s\": " query)
+                                     collection nil t))))
 
 (add-to-list 'eaf-app-binding-alist '("video-player" . eaf-video-player-keybinding))
 
@@ -128,11 +242,27 @@
 
 (add-to-list 'eaf-app-extensions-alist '("video-player" . eaf-video-extension-list))
 
-(defun eaf-video-player-lookup (text x y)
-  (eaf-call-async "execute_function_with_args" eaf--buffer-id "message_box_update" text x y))
+(defun eaf-video-player-lookup (buffer-id text x y)
+  "Look up TEXT and show the result at X, Y in the player of BUFFER-ID."
+  (eaf-call-async "execute_function_with_args" buffer-id "message_box_update"
+                  (funcall eaf-video-player-lookup-function text) x y text))
+
+(defun eaf-video-player-prefetch (buffer-id &rest words)
+  "Look up WORDS and send all results back to the player of BUFFER-ID in one call.
+The player passes its own BUFFER-ID, the current buffer may be another one."
+  (eaf-call-async "execute_function_with_args" buffer-id "lookup_cache_fill"
+                  (json-encode
+                   (mapcar (lambda (word)
+                             (cons word (funcall eaf-video-player-lookup-function word)))
+                           words))))
+
+(defun eaf-video-player--batch (calls)
+  "Run CALLS, a JSON list of [FUNCTION ARGS...], queued by the player in one RPC."
+  (dolist (call (json-parse-string calls :array-type 'list))
+    (apply (intern (car call)) (cdr call))))
 
-(defun eaf-video-player-explain-sentence (text x y)
-  (eaf-call-async "execute_function_with_args" eaf--buffer-id "message_box_update" text x y))
+(defun eaf-video-player-explain-sentence (buffer-id text x y)
+  (eaf-call-async "execute_function_with_args" buffer-id "message_box_update" text x y))
 
 
 (provide 'eaf-video-player)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Tests of `CueIndex' search ranking.
+
+Set EAF_PATH to an EAF checkout so `core' can be imported:
+
+  EAF_PATH=~/.emacs.d/site-lisp/emacs-application-framework \
+      python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+PLAYER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.environ.get("EAF_PATH"):
+    sys.path.insert(0, os.path.expanduser(os.environ["EAF_PATH"]))
+sys.path.insert(0, PLAYER_DIR)
+
+try:
+    import buffer
+except ImportError as e:
+    raise unittest.SkipTest(f"buffer.py needs EAF and PyQt6: {e}")
+
+
+def cue_index(*texts):
+    starts = [index * 1000 for index in range(len(texts))]
+    ends = [start + 500 for start in starts]
+    return buffer.CueIndex(buffer.CueTimeline(starts, ends, texts))
+
+
+class CueIndexTest(unittest.TestCase):
+    def test_more_words_rank_first(self):
+        index = cue_index("hello", "goodbye", "hello world")
+        self.assertEqual(index.search("hello world"), [2, 0])
+
+    def test_ties_keep_timeline_order(self):
+        # "world" and "hel" are as rare as each other, cues 1 and 2 tie.
+        index = cue_index("hello world", "world", "help")
+        self.assertEqual(index.search("world hel"), [0, 1, 2])
+        index = cue_index("world", "hello world", "hello")
+        self.assertEqual(index.search("hello world"), [1, 0, 2])
+
+    def test_rarer_words_weigh_more(self):
+        index = cue_index("common", "common", "common", "rare", "common rare")
+        self.assertEqual(index.search("common rare"), [4, 3, 0, 1, 2])
+
+    def test_last_word_matches_as_prefix(self):
+        index = cue_index("Hello", "<i>HELP</i>", "shell")
+        self.assertEqual(index.search("hel"), [0, 1])
+        self.assertEqual(index.search("hel world"), [])
+
+    def test_empty_query_lists_cues_in_order(self):
+        index = cue_index("a", "b", "c")
+        self.assertEqual(index.search("  ", limit=2), [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
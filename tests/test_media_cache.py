@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Tests of `MediaCacheProxy' against a local http.server standing in for
+the remote host.
+
+Set EAF_PATH to an EAF checkout so `core' can be imported:
+
+  EAF_PATH=~/.emacs.d/site-lisp/emacs-application-framework \
+      python -m unittest discover tests
+"""
+
+import base64
+import http.server
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+PLAYER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.environ.get("EAF_PATH"):
+    sys.path.insert(0, os.path.expanduser(os.environ["EAF_PATH"]))
+sys.path.insert(0, PLAYER_DIR)
+
+try:
+    import buffer
+except ImportError as e:
+    raise unittest.SkipTest(f"buffer.py needs EAF and PyQt6: {e}")
+
+# Small chunks, so a few KiB span several of them.
+CHUNK_SIZE = 1024
+PAYLOAD = bytes(range(256)) * 40
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    """Serve PAYLOAD at any path, honouring Range requests."""
+
+    protocol_version = "HTTP/1.1"
+    ranges = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start, end = 0, len(PAYLOAD) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if self.ranges and match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(PAYLOAD[start : end + 1])
+
+
+class NoRangeOriginHandler(OriginHandler):
+    """Serve PAYLOAD whole, whatever range is asked for."""
+
+    ranges = False
+
+
+class MediaCacheProxyTest(unittest.TestCase):
+    origin_handler = OriginHandler
+
+    def setUp(self):
+        chunk_size = buffer.SegmentCache.CHUNK_SIZE
+        buffer.SegmentCache.CHUNK_SIZE = CHUNK_SIZE
+        self.addCleanup(setattr, buffer.SegmentCache, "CHUNK_SIZE", chunk_size)
+
+        self.directory = tempfile.mkdtemp(prefix="eaf-video-player-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        origin = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.origin_handler)
+        origin.daemon_threads = True
+        threading.Thread(target=origin.serve_forever, daemon=True).start()
+        self.addCleanup(origin.server_close)
+        self.addCleanup(origin.shutdown)
+        self.url = f"http://127.0.0.1:{origin.server_port}/video.mp4"
+
+        self.proxy = buffer.MediaCacheProxy(
+            buffer.SegmentCache(self.directory, 64 * CHUNK_SIZE)
+        )
+        self.addCleanup(self.proxy.server.server_close)
+        self.addCleanup(self.proxy.server.shutdown)
+
+    def get(self, url, byte_range=None):
+        headers = {"Range": f"bytes={byte_range}"} if byte_range else {}
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.headers, response.read()
+
+    def test_whole_file(self):
+        status, headers, data = self.get(self.proxy.proxy_url(self.url))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Accept-Ranges"], "bytes")
+        self.assertEqual(data, PAYLOAD)
+
+    def test_range(self):
+        status, headers, data = self.get(self.proxy.proxy_url(self.url), "1000-3099")
+        self.assertEqual(status, 206)
+        self.assertEqual(headers["Content-Range"], f"bytes 1000-3099/{len(PAYLOAD)}")
+        self.assertEqual(data, PAYLOAD[1000:3100])
+
+    def test_open_ended_range(self):
+        status, _, data = self.get(self.proxy.proxy_url(self.url), "9000-")
+        self.assertEqual(status, 206)
+        self.assertEqual(data, PAYLOAD[9000:])
+
+    def test_suffix_range(self):
+        status, headers, data = self.get(self.proxy.proxy_url(self.url), "-1500")
+        self.assertEqual(status, 206)
+        start = len(PAYLOAD) - 1500
+        self.assertEqual(
+            headers["Content-Range"], f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"
+        )
+        self.assertEqual(data, PAYLOAD[-1500:])
+
+    def test_served_again_from_cache(self):
+        proxy_url = self.proxy.proxy_url(self.url)
+        self.get(proxy_url, "0-2047")
+        self.assertTrue(self.proxy.cache.is_cached(self.url, 0))
+        self.assertTrue(self.proxy.cache.is_cached(self.url, 1))
+        self.assertEqual(self.get(proxy_url, "100-1999")[2], PAYLOAD[100:2000])
+
+    def test_unregistered_url_is_refused(self):
+        other = self.url.replace("video.mp4", "other.mp4")
+        token = base64.urlsafe_b64encode(other.encode("utf-8")).decode("ascii")
+        port = self.proxy.server.server_port
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self.get(f"http://127.0.0.1:{port}/{token}/other.mp4")
+        self.assertEqual(error.exception.code, 404)
+
+    def test_file_url_is_refused(self):
+        path = os.path.join(self.directory, "secret.txt")
+        with open(path, "w") as f:
+            f.write("secret")
+        url = "file://" + path
+        with self.assertRaises(ValueError):
+            self.proxy.proxy_url(url)
+
+        # Not even if it ended up registered somehow.
+        self.proxy.registered.add(url)
+        token = base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii")
+        port = self.proxy.server.server_port
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self.get(f"http://127.0.0.1:{port}/{token}/secret.txt")
+        self.assertEqual(error.exception.code, 404)
+
+
+class NoRangeMediaCacheProxyTest(MediaCacheProxyTest):
+    """The same, from a host that ignores Range and always sends the whole file."""
+
+    origin_handler = NoRangeOriginHandler
+
+
+if __name__ == "__main__":
+    unittest.main()
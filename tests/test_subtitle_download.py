@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Tests of `SubtitleDownloader' and `SubliminalProvider', with fake providers.
+
+Set EAF_PATH to an EAF checkout so `core' can be imported:
+
+  EAF_PATH=~/.emacs.d/site-lisp/emacs-application-framework \
+      python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+PLAYER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.environ.get("EAF_PATH"):
+    sys.path.insert(0, os.path.expanduser(os.environ["EAF_PATH"]))
+sys.path.insert(0, PLAYER_DIR)
+
+try:
+    import buffer
+except ImportError as e:
+    raise unittest.SkipTest(f"buffer.py needs EAF and PyQt6: {e}")
+
+SRT = "1\n00:00:01,000 --> 00:00:02,000\nHello\n"
+
+
+class FakeProvider:
+    """Answers every request with one subtitle per language, counting calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def download(self, video_path, languages):
+        self.calls.append(list(languages))
+        return [(language, SRT) for language in languages]
+
+
+class FakeLanguage:
+    """Enough of `babelfish.Language': "en" and "eng" are one language,
+    printed as its two letter code."""
+
+    ALPHA2 = {"en": "eng", "fr": "fra"}
+
+    def __init__(self, alpha3):
+        self.alpha3 = alpha3
+
+    @classmethod
+    def fromietf(cls, tag):
+        return cls(cls.ALPHA2.get(tag, tag))
+
+    def __eq__(self, other):
+        return self.alpha3 == other.alpha3
+
+    def __hash__(self):
+        return hash(self.alpha3)
+
+    def __str__(self):
+        for alpha2, alpha3 in self.ALPHA2.items():
+            if alpha3 == self.alpha3:
+                return alpha2
+        return self.alpha3
+
+
+class SubtitleDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="eaf-video-player-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        config_dir = os.path.join(self.directory, "config")
+        get_emacs_config_dir = buffer.get_emacs_config_dir
+        buffer.get_emacs_config_dir = lambda: config_dir
+        self.addCleanup(setattr, buffer, "get_emacs_config_dir", get_emacs_config_dir)
+
+        self.video_path = os.path.join(self.directory, "movie.mp4")
+        with open(self.video_path, "wb") as f:
+            f.write(os.urandom(256 * 1024))
+
+    def fake_subliminal(self):
+        """Install fake babelfish and subliminal modules, return the download log."""
+        downloads = []
+
+        def download_best_subtitles(videos, languages):
+            downloads.append(set(languages))
+            subtitles = [
+                types.SimpleNamespace(language=language, text=SRT)
+                for language in languages
+            ]
+            return {video: subtitles for video in videos}
+
+        modules = {
+            "babelfish": types.SimpleNamespace(Language=FakeLanguage),
+            "subliminal": types.SimpleNamespace(
+                download_best_subtitles=download_best_subtitles,
+                region=types.SimpleNamespace(configure=lambda *args, **kwargs: None),
+                scan_video=lambda path: path,
+            ),
+        }
+        for name, module in modules.items():
+            self.addCleanup(sys.modules.pop, name, None)
+            sys.modules[name] = module
+        return downloads
+
+    def test_cached_download_is_not_fetched_again(self):
+        provider = FakeProvider()
+        downloader = buffer.SubtitleDownloader(provider)
+
+        first = downloader.fetch(self.video_path, ["eng"])
+        second = downloader.fetch(self.video_path, ["eng"])
+
+        self.assertEqual(provider.calls, [["eng"]])
+        self.assertEqual(first, [os.path.join(self.directory, "movie.eng.srt")])
+        self.assertEqual(second, first)
+
+    def test_only_missing_languages_are_fetched(self):
+        provider = FakeProvider()
+        downloader = buffer.SubtitleDownloader(provider)
+
+        downloader.fetch(self.video_path, ["en"])
+        paths = downloader.fetch(self.video_path, ["en", "fr"])
+
+        self.assertEqual(provider.calls, [["en"], ["fr"]])
+        self.assertEqual(
+            [os.path.basename(path) for path in paths], ["movie.en.srt", "movie.fr.srt"]
+        )
+
+    def test_subliminal_answers_with_the_requested_tag(self):
+        downloads = self.fake_subliminal()
+        provider = buffer.SubliminalProvider()
+
+        self.assertEqual(provider.download(self.video_path, ["eng"]), [("eng", SRT)])
+        self.assertEqual(provider.download(self.video_path, ["en"]), [("en", SRT)])
+        self.assertEqual(len(downloads), 2)
+
+    def test_three_letter_tag_is_cached(self):
+        downloads = self.fake_subliminal()
+        downloader = buffer.SubtitleDownloader(buffer.SubliminalProvider())
+
+        downloader.fetch(self.video_path, ["eng"])
+        paths = downloader.fetch(self.video_path, ["eng"])
+
+        self.assertEqual(len(downloads), 1)
+        self.assertEqual(paths, [os.path.join(self.directory, "movie.eng.srt")])
+
+
+if __name__ == "__main__":
+    unittest.main()